@@ -3,51 +3,371 @@
 @author: Xueyao Zhao
 """
 
+import hashlib
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import joblib
+import numpy as np
+import pandas as pd
+import sklearn
 from sklearn.ensemble import RandomForestClassifier
-from sklearn.model_selection import train_test_split
+from sklearn.model_selection import StratifiedKFold, cross_val_score, train_test_split
 from sklearn.metrics import accuracy_score, classification_report
 from sklearn.utils import shuffle
 
+from inferenceAPI import FlatForest
+
+
+FEATURE_COLUMNS = [
+    "Age", "BMI", "SmokingHabit",
+    "DrinkingHabit", "ExerciseLevel", "SleepQuality", "HeartRate", "BloodPressure",
+    "Mental", "Physical", "Happiness"
+]
+
+ARTIFACT_VERSION = 4  # Bump when the layout of saved model artifacts changes
+
+
+# Training data of a hyperparameter search, sent once to each worker process by _init_search_worker
+_search_data = {}
+
+
+def _init_search_worker(X, y):
+    _search_data["X"] = X
+    _search_data["y"] = y
+
+
+def _evaluate_configuration(params, cv):
+    """Cross-validate one forest configuration in a search worker; returns (params, scores, seconds)."""
+    start = time.perf_counter()
+    model = RandomForestClassifier(random_state=42, n_jobs=1, **params)  # The pool already uses the cores
+    folds = StratifiedKFold(n_splits=cv, shuffle=True, random_state=42)
+    scores = cross_val_score(model, _search_data["X"], _search_data["y"], cv=folds)
+    return params, scores, time.perf_counter() - start
 
 
 class MLAPI:
-    def __init__(self):
-        """Initialize an empty RandomForestClassifier."""
-        self.model = RandomForestClassifier(random_state=42)
+    def __init__(self, full_refit_interval=24 * 3600, warm_start_trees=10, max_warm_start_trees=100,
+                 drift_threshold=0.25, n_jobs=None, flat_inference_rows=64):
+        """
+        Initialize an empty RandomForestClassifier and the retraining policy used by retrain.
+        Args:
+            full_refit_interval (float): Seconds after a full fit when retrain refits from scratch again (None: never).
+            warm_start_trees (int): Trees added by a warm-started retrain when new labeled rows arrive.
+            max_warm_start_trees (int): Trees that may be added on top of a full fit before the next full refit.
+            drift_threshold (float): Largest change of a feature mean, in standard deviations of the data
+                                     at the last full fit, that retrain tolerates before refitting.
+            n_jobs (int): Cores used to build and evaluate trees (-1: all cores, None: one).
+            flat_inference_rows (int): predict_risk scores frames up to this many rows with the flattened
+                                       NumPy forest (inferenceAPI.FlatForest) instead of sklearn (0 disables it).
+        """
+        self.n_jobs = n_jobs
+        self.model = RandomForestClassifier(random_state=42, n_jobs=n_jobs)
+        self.flat_inference_rows = flat_inference_rows
+        self.flat_forest = None  # FlatForest export of self.model, built on first use
+        self.feature_columns = FEATURE_COLUMNS
+        self.fingerprint = None  # Fingerprint of the data the current model was trained on
+        self.full_refit_interval = full_refit_interval
+        self.warm_start_trees = warm_start_trees
+        self.max_warm_start_trees = max_warm_start_trees
+        self.drift_threshold = drift_threshold
+        self._reset_retrain_state()
 
-    def train_model(self, training_data):
-        """Train the random forest model."""
-        feature_columns = [
-            "Age", "BMI", "SmokingHabit",
-            "DrinkingHabit", "ExerciseLevel", "SleepQuality", "HeartRate", "BloodPressure",
-            "Mental", "Physical", "Happiness"
-        ]
-        
-        training_data = shuffle(training_data, random_state=42)
-        X = training_data[feature_columns]
-        y = training_data["HasChronicDisease"]
-        
+    def _reset_retrain_state(self):
+        self.base_estimators = self.model.n_estimators  # Forest size after the last full fit
+        self.last_full_fit = None  # time.time() of the last full fit
+        self.training_rows = None  # Sorted row hashes of the data the model was last fitted on
+        self.training_metrics = None  # Hold-out accuracy and sizes of the last fit, see _record_fit
+        self.reference_means = None  # Feature means and standard deviations at the last full fit
+        self.reference_stds = None
 
-        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2)
+    def _training_arrays(self, training_data):
+        """
+        Feature matrix (float32, as the forest consumes it) and labels of a training set.
+        training_data is a DataFrame (as from InsuranceAPI.fetch_training_data) or a FeatureStore,
+        whose labeled rows are returned without a copy.
+        """
+        if isinstance(training_data, pd.DataFrame):
+            X = training_data[self.feature_columns].to_numpy(dtype=np.float32)
+            y = training_data["HasChronicDisease"].to_numpy()
+            return X, y
+        return training_data.training_arrays()
 
-        self.model.fit(X_train, y_train)
+    def _row_hashes(self, X, y):
+        """Sorted 64-bit hashes of the feature and label values of every row."""
+        rows = pd.DataFrame(X)
+        rows["label"] = np.asarray(y, dtype=np.int64)
+        return np.sort(pd.util.hash_pandas_object(rows, index=False).to_numpy())
+
+    def training_fingerprint(self, training_data):
+        """
+        Fingerprint training data independently of row order.
+        Args:
+            training_data (DataFrame or FeatureStore): Rows with the feature columns and HasChronicDisease.
+        Returns:
+            str: SHA-256 hex digest of the feature and label values.
+        """
+        return hashlib.sha256(self._row_hashes(*self._training_arrays(training_data)).tobytes()).hexdigest()
+
+    def _split(self, X, y):
+        """Shuffle and hold out 20% of the rows, as every fit does."""
+        X, y = shuffle(X, y, random_state=42)
+        return train_test_split(X, y, test_size=0.2)
+
+    def _record_fit(self, X, y, X_test, y_test):
+        self.flat_forest = None
+        self.training_rows = self._row_hashes(X, y)
+        self.fingerprint = hashlib.sha256(self.training_rows.tobytes()).hexdigest()
         predictions = self.model.predict(X_test)
+        self.training_metrics = {
+            "accuracy": float(accuracy_score(y_test, predictions)),  # On the 20% held out of the fit
+            "training_rows": int(len(X)),
+            "test_rows": int(len(X_test)),
+            "n_estimators": int(self.model.n_estimators),
+            "trained_at": time.strftime("%Y-%m-%dT%H:%M:%S")
+        }
         # print("Model Training Completed.")
         # print(classification_report(y_test, predictions))
 
-    def predict_risk(self, unlabeled_data):
-        """Predict chronic disease risk."""
-        feature_columns = [
-            "Age", "BMI", "SmokingHabit",
-            "DrinkingHabit", "ExerciseLevel", "SleepQuality", "HeartRate", "BloodPressure",
-            "Mental", "Physical", "Happiness"
+    def train_model(self, training_data):
+        """
+        Train the random forest model.
+        Args:
+            training_data (DataFrame or FeatureStore): Labeled rows; a FeatureStore skips the DataFrame conversion.
+        """
+        X, y = self._training_arrays(training_data)
+        X_train, X_test, y_train, y_test = self._split(X, y)
+
+        self.model.set_params(warm_start=False, n_estimators=self.base_estimators)
+        self.model.fit(X_train, y_train)
+        self._record_fit(X, y, X_test, y_test)
+        self.reference_means = X.mean(axis=0, dtype=np.float64)
+        self.reference_stds = X.std(axis=0, ddof=1, dtype=np.float64)
+        self.last_full_fit = time.time()
+
+    def feature_drift(self, training_data):
+        """
+        Largest shift of a feature mean since the last full fit.
+        Returns:
+            float: |mean - reference mean| / reference standard deviation, maximized over the features.
+        """
+        X, y = self._training_arrays(training_data)
+        means = X.mean(axis=0, dtype=np.float64)
+        shift = np.abs(means - self.reference_means) / np.where(self.reference_stds > 0, self.reference_stds, 1.0)
+        return float(np.nanmax(shift))
+
+    def retrain_decision(self, training_data):
+        """
+        Decide how the model should follow the current training data.
+        Returns:
+            str: "skip" when the labeled data is unchanged, "warm_start" when rows were only added,
+                 "full" when no fit is on record, the schedule is due, features drifted, rows changed
+                 or were removed, or the forest already grew by max_warm_start_trees.
+        """
+        if self.training_rows is None or self.reference_means is None:
+            return "full"
+        X, y = self._training_arrays(training_data)
+        row_hashes = self._row_hashes(X, y)
+        if hashlib.sha256(row_hashes.tobytes()).hexdigest() == self.fingerprint:
+            return "skip"
+        if self.full_refit_interval is not None and (
+                self.last_full_fit is None or time.time() - self.last_full_fit > self.full_refit_interval):
+            return "full"
+        if self.feature_drift(training_data) > self.drift_threshold:
+            return "full"
+        if not np.isin(self.training_rows, row_hashes).all():
+            return "full"
+        if self.model.n_estimators + self.warm_start_trees > self.base_estimators + self.max_warm_start_trees:
+            return "full"
+        return "warm_start"
+
+    def retrain(self, training_data):
+        """
+        Bring the model up to date with the least work the retraining policy allows.
+        Args:
+            training_data (DataFrame or FeatureStore): The current labeled data (as from
+                                                       InsuranceAPI.fetch_training_data).
+        Returns:
+            str: What was done: "skip", "warm_start" (warm_start_trees trees fitted and added) or "full".
+        """
+        decision = self.retrain_decision(training_data)
+        if decision == "full":
+            self.train_model(training_data)
+        elif decision == "warm_start":
+            X, y = self._training_arrays(training_data)
+            X_train, X_test, y_train, y_test = self._split(X, y)
+            self.model.set_params(warm_start=True, n_estimators=self.model.n_estimators + self.warm_start_trees)
+            self.model.fit(X_train, y_train)  # Only the added trees are fitted
+            self._record_fit(X, y, X_test, y_test)
+        return decision
+
+    def hyperparameter_search(self, training_data, n_estimators=(100, 200, 400), max_depth=(None, 10, 20),
+                              min_samples_leaf=(1, 2, 4), cv=5, max_workers=None, refit=True):
+        """
+        Cross-validate every combination of the given forest settings in parallel worker processes.
+        Args:
+            training_data (DataFrame or FeatureStore): Rows with the feature columns and HasChronicDisease.
+            n_estimators, max_depth, min_samples_leaf (tuple): Values tried for each setting.
+            cv (int): Number of stratified folds.
+            max_workers (int): Worker processes (None: one per core); each fits with a single core.
+            refit (bool): Adopt the best configuration and train the model with it.
+        Returns:
+            pd.DataFrame: One row per configuration with its mean and standard deviation of accuracy and
+                          the wall time its cross-validation took, best configuration first.
+        """
+        X, y = self._training_arrays(training_data)
+        grid = [
+            {"n_estimators": trees, "max_depth": depth, "min_samples_leaf": leaf}
+            for trees, depth, leaf in itertools.product(n_estimators, max_depth, min_samples_leaf)
         ]
-        X = unlabeled_data[feature_columns]
-        predictions = self.model.predict(X)
-        probabilities = self.model.predict_proba(X)
-
-        results = unlabeled_data.copy()
-        results["AtRisk"] = predictions
-        results["RiskLevel"] = probabilities[:, 1] * 100  # Use the probability of being 'AtRisk'
-        results["ConfidenceScore"] = probabilities[:, 1]
-        return results
\ No newline at end of file
+
+        rows = []
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_search_worker, initargs=(X, y)) as executor:
+            for params, scores, seconds in executor.map(_evaluate_configuration, grid, [cv] * len(grid)):
+                rows.append({**params, "mean_score": scores.mean(), "std_score": scores.std(), "seconds": seconds})
+        results = pd.DataFrame(rows).sort_values("mean_score", ascending=False, kind="stable").reset_index(drop=True)
+        results["max_depth"] = results["max_depth"].astype("Int64")  # <NA> is an unlimited depth
+
+        if refit:
+            best = results.iloc[0]
+            self.model.set_params(
+                max_depth=None if pd.isna(best["max_depth"]) else int(best["max_depth"]),
+                min_samples_leaf=int(best["min_samples_leaf"])
+            )
+            self.base_estimators = int(best["n_estimators"])
+            self.train_model(training_data)
+        return results
+
+    def get_flat_forest(self):
+        """The model flattened for low-latency inference, exported on first use after each fit or load."""
+        if self.flat_forest is None:
+            self.flat_forest = FlatForest.from_model(self.model)
+        return self.flat_forest
+
+    def save_model(self, model_dir):
+        """
+        Write the trained model and its metadata to a directory.
+        Args:
+            model_dir (str): Artifact directory holding model.joblib, training_rows.npy (row hashes used by retrain),
+                             flat_forest/ (arrays of the flattened forest) and metadata.json; replaced as a whole.
+        Returns:
+            dict: The metadata written next to the model.
+        """
+        metadata = {
+            "version": ARTIFACT_VERSION,
+            "sklearn_version": sklearn.__version__,
+            "feature_columns": self.feature_columns,
+            "fingerprint": self.fingerprint,
+            "saved_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "base_estimators": self.base_estimators,
+            "last_full_fit": self.last_full_fit,
+            "training_metrics": self.training_metrics,
+            "reference_means": None if self.reference_means is None else self.reference_means.tolist(),
+            "reference_stds": None if self.reference_stds is None else self.reference_stds.tolist()
+        }
+        # Write the whole artifact to a sibling directory and swap it in, so a crash never leaves
+        # model.joblib, the flat forest and the metadata of different fits side by side
+        model_dir = os.path.abspath(model_dir)
+        os.makedirs(os.path.dirname(model_dir), exist_ok=True)
+        staging_dir = tempfile.mkdtemp(prefix=os.path.basename(model_dir) + ".", dir=os.path.dirname(model_dir))
+        try:
+            joblib.dump(self.model, os.path.join(staging_dir, "model.joblib"))  # Uncompressed, so it can be memory-mapped
+            self.get_flat_forest().save(os.path.join(staging_dir, "flat_forest"))
+            if self.training_rows is not None:
+                np.save(os.path.join(staging_dir, "training_rows.npy"), self.training_rows)
+            with open(os.path.join(staging_dir, "metadata.json"), "w") as f:
+                json.dump(metadata, f, indent=2)
+            if os.path.exists(model_dir):
+                old_dir = staging_dir + ".old"
+                os.replace(model_dir, old_dir)
+                os.replace(staging_dir, model_dir)
+                shutil.rmtree(old_dir)
+            else:
+                os.replace(staging_dir, model_dir)
+        except BaseException:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            raise
+        return metadata
+
+    def load_model(self, model_dir, expected_fingerprint=None):
+        """
+        Load a model written by save_model. joblib memory-maps the stored arrays rather than reading the
+        file into buffers (scikit-learn still copies each tree's nodes out of the map when rebuilding it).
+        Args:
+            model_dir (str): Artifact directory.
+            expected_fingerprint (str): When set, refuse a model trained on different data.
+        Returns:
+            dict: The artifact's metadata.
+        Raises:
+            FileNotFoundError: No artifact in model_dir.
+            ValueError: The artifact is from another format version or scikit-learn release, uses other
+                        feature columns, or does not match expected_fingerprint; retrain instead.
+        """
+        with open(os.path.join(model_dir, "metadata.json")) as f:
+            metadata = json.load(f)
+        if metadata.get("version") != ARTIFACT_VERSION:
+            raise ValueError(f"Model artifact version {metadata.get('version')} is not {ARTIFACT_VERSION}")
+        if metadata.get("sklearn_version") != sklearn.__version__:
+            raise ValueError(f"Model was saved with scikit-learn {metadata.get('sklearn_version')}")
+        if metadata.get("feature_columns") != self.feature_columns:
+            raise ValueError("Model was trained on different feature columns")
+        if expected_fingerprint is not None and metadata.get("fingerprint") != expected_fingerprint:
+            raise ValueError("Model was trained on different data")
+
+        self.model = joblib.load(os.path.join(model_dir, "model.joblib"), mmap_mode="r")
+        self.fingerprint = metadata.get("fingerprint")
+        self._reset_retrain_state()
+        self.base_estimators = metadata["base_estimators"]
+        self.last_full_fit = metadata["last_full_fit"]
+        self.training_metrics = metadata.get("training_metrics")
+        if metadata["reference_means"] is not None:
+            self.reference_means = np.array(metadata["reference_means"])
+            self.reference_stds = np.array(metadata["reference_stds"])
+        rows_path = os.path.join(model_dir, "training_rows.npy")
+        if os.path.exists(rows_path):
+            self.training_rows = np.load(rows_path, mmap_mode="r")
+        try:
+            self.flat_forest = FlatForest.load(os.path.join(model_dir, "flat_forest"))  # Memory-mapped, no copy
+        except FileNotFoundError:
+            self.flat_forest = None
+        return metadata
+
+    def predict_risk(self, unlabeled_data):
+        """
+        Predict chronic disease risk.
+        The forest runs once: AtRisk is the most probable class, as model.predict would return it.
+        Args:
+            unlabeled_data (DataFrame or FeatureStore): CustSsn and the feature columns, or a FeatureStore
+                                                        whose undetermined rows are scored without a copy.
+        Returns:
+            DataFrame: CustSsn, AtRisk, RiskLevel and ConfidenceScore only, on the input's index
+                       (the input frame is neither copied nor modified).
+        """
+        if isinstance(unlabeled_data, pd.DataFrame):
+            cust_ssns = unlabeled_data["CustSsn"].to_numpy()
+            X = unlabeled_data[self.feature_columns].to_numpy(dtype=np.float32)
+            index = unlabeled_data.index
+        else:
+            cust_ssns, X = unlabeled_data.scoring_arrays()
+            index = None
+
+        if len(X) <= self.flat_inference_rows:
+            flat_forest = self.get_flat_forest()
+            probabilities = flat_forest.predict_proba(X)
+            classes = flat_forest.classes
+        else:
+            probabilities = self.model.predict_proba(X)
+            classes = self.model.classes_
+
+        at_risk_probability = probabilities[:, 1]  # Use the probability of being 'AtRisk'
+        return pd.DataFrame({
+            "CustSsn": cust_ssns,
+            "AtRisk": classes.take(np.argmax(probabilities, axis=1)),
+            "RiskLevel": at_risk_probability * 100,
+            "ConfidenceScore": at_risk_probability
+        }, index=index)
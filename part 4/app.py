@@ -6,6 +6,8 @@
 from insuranceAPI import InsuranceAPI
 from clientAPI import ClientAPI
 from MLAPI import MLAPI
+from featureStoreAPI import FeatureStore
+from modelRegistryAPI import ModelRegistry
 from sensitivityAPI import SensitivityAPI
 
 
@@ -41,15 +43,28 @@ def main():
     insurance_api.insert_dataframe("ChronicDiseaseHistory", chronic_disease_history_df, db_name)
     # print("Data insertion completed.")
 
-    # Train model
-    training_data = insurance_api.fetch_training_data(db_name)
-    ml_api.train_model(training_data)
+    # Keep the model features in a memory-mapped store that the write methods keep current
+    feature_store = FeatureStore("features")
+    insurance_api.attach_feature_store(feature_store, db_name)
 
-    # Predict
-    unlabeled_data = insurance_api.fetch_unlabeled_data(db_name)
-    predictions = ml_api.predict_risk(unlabeled_data)
+    # Reuse a registered model trained on exactly this data; otherwise bring the active one up to date
+    model_registry = ModelRegistry("models")
+    try:
+        version = model_registry.find_version(ml_api.training_fingerprint(feature_store))
+        if version is not None:
+            model_registry.load(version, ml_api)
+            if version != model_registry.active_version():
+                model_registry.promote(version)
+        else:
+            model_registry.load_active(ml_api)
+            ml_api.retrain(feature_store)  # Warm start or full refit, as the retraining policy decides
+            model_registry.promote(model_registry.register(ml_api))
+    except (FileNotFoundError, ValueError):
+        ml_api.train_model(feature_store)
+        model_registry.promote(model_registry.register(ml_api))
 
-    # Insert predictions into the database
+    # Predict and insert predictions into the database
+    predictions = ml_api.predict_risk(feature_store)
     insurance_api.insert_clustering_results(predictions, db_name)
     
     # Generate products
@@ -57,6 +72,8 @@ def main():
     
     # Insert into the database
     insurance_api.insert_dataframe("Product", product_df, db_name)
+    insurance_api.load_product_catalog(db_name)
+    insurance_api.warm_customer_profiles(db_name)
     
     # Fetch a random undetermined client
     client_ssn = insurance_api.get_random_undetermined_client(db_name)
@@ -65,10 +82,9 @@ def main():
     #if client_ssn is not None:
     #    recommendation_message = insurance_api.recommend_products(client_ssn, db_name)
     
-    # Fetch user name
-    client_name_query = f"SELECT CustFirstName, CustLastName FROM Customer WHERE CustSsn = {client_ssn}"
-    client_name = insurance_api.run_custom_query(client_name_query, db_name)
-    full_name = f"{client_name[0][0]} {client_name[0][1]}"
+    # Fetch user name from the profile cache
+    client_profile = insurance_api.get_customer_profile(client_ssn, db_name)
+    full_name = f"{client_profile['CustFirstName']} {client_profile['CustLastName']}"
     
 
     print(f"\nHello {full_name}! How are you doing today?")
@@ -124,9 +140,9 @@ def main():
     
     
     # Step 6: Retrain the model
-    # Retrain the model
-    training_data = insurance_api.fetch_training_data(db_name)
-    ml_api.train_model(training_data)
+    # Retrain only as far as the policy requires (usually nothing: the labeled data did not change)
+    if ml_api.retrain(feature_store) != "skip":
+        model_registry.promote(model_registry.register(ml_api))
     
     # Fetch data for the specific user whose metrics were updated
     user_data = insurance_api.fetch_unlabeled_data_for_user(db_name, client_ssn)
@@ -142,5 +158,8 @@ def main():
     if client_ssn is not None:
         recommendation_message = insurance_api.recommend_products(client_ssn, db_name)
 
+    # Release the pooled database connections
+    insurance_api.close_pools()
+
 if __name__ == "__main__":
     main()
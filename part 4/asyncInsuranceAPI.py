@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Xueyao Zhao
+"""
+
+import asyncio
+import aiomysql
+import pandas as pd
+
+class AsyncInsuranceAPI:
+    def __init__(self, host, user, password, pool_minsize=1, pool_maxsize=50, pool_recycle=3600):
+        """
+        Initialize the connection settings for the asyncio variant of InsuranceAPI.
+        Args:
+            pool_minsize (int): Connections opened when a database's pool is created.
+            pool_maxsize (int): Upper bound on connections per database; extra sessions wait for a free one.
+            pool_recycle (int): Seconds after which idle connections are reopened (-1 disables it).
+        """
+        self.host = host
+        self.user = user
+        self.password = password
+        self.pool_minsize = pool_minsize
+        self.pool_maxsize = pool_maxsize
+        self.pool_recycle = pool_recycle
+        self.pools = {}  # One aiomysql pool per database name
+        self._pool_lock = asyncio.Lock()
+
+    async def _get_pool(self, db_name):
+        """Return the pool for db_name, creating it on first use."""
+        async with self._pool_lock:
+            if db_name not in self.pools:
+                self.pools[db_name] = await aiomysql.create_pool(
+                    minsize=self.pool_minsize,
+                    maxsize=self.pool_maxsize,
+                    pool_recycle=self.pool_recycle,
+                    autocommit=True,  # Reads must not pin a stale snapshot on pooled connections
+                    host=self.host,
+                    user=self.user,
+                    password=self.password,
+                    db=db_name
+                )
+            return self.pools[db_name]
+
+    async def _fetch_dataframe(self, query, db_name, params=None):
+        """Run a SELECT and return the result as a DataFrame."""
+        pool = await self._get_pool(db_name)
+        async with pool.acquire() as connection:
+            async with connection.cursor() as cursor:
+                await cursor.execute(query, params)
+                result = await cursor.fetchall()
+                columns = [col[0] for col in cursor.description]
+        return pd.DataFrame(list(result), columns=columns)
+
+    async def _execute_many(self, query, rows, db_name):
+        """Run a write statement for every parameter tuple in rows and commit once."""
+        pool = await self._get_pool(db_name)
+        async with pool.acquire() as connection:
+            async with connection.cursor() as cursor:
+                await connection.begin()
+                try:
+                    await cursor.executemany(query, rows)
+                    await connection.commit()
+                except aiomysql.Error:
+                    await connection.rollback()
+                    raise
+
+    async def fetch_training_data(self, db_name):
+        """
+        Fetch training data by joining HealthMetrics and ChronicDiseaseHistory.
+        Excludes undetermined entries (customers without entries in ChronicDiseaseHistory).
+        """
+        query = """
+        SELECT
+            hm.CustSsn, hm.Age, hm.Weight, hm.Height, hm.BMI,
+            hm.SmokingHabit, hm.DrinkingHabit, hm.ExerciseLevel,
+            hm.SleepQuality, hm.HeartRate, hm.BloodPressure,
+            hm.Mental, hm.Physical, hm.Happiness,
+            cd.HasChronicDisease
+        FROM HealthMetrics hm
+        INNER JOIN ChronicDiseaseHistory cd
+        ON hm.CustSsn = cd.CustSsn
+        WHERE cd.HasChronicDisease IN (1, 0)
+        """
+        try:
+            return await self._fetch_dataframe(query, db_name)
+        except aiomysql.Error as err:
+            print(f"Error fetching training data: {err}")
+            return pd.DataFrame()
+
+    async def fetch_unlabeled_data_for_user(self, db_name, cust_ssn):
+        """
+        Fetch data for prediction for a specific user.
+        Args:
+            db_name (str): Database name.
+            cust_ssn (int): Customer SSN to filter.
+        Returns:
+            DataFrame: DataFrame containing health metrics for the specified user.
+        """
+        query = """
+        SELECT
+            CustSsn, Age, BMI, Weight, Height, SmokingHabit,
+            DrinkingHabit, ExerciseLevel, SleepQuality, HeartRate, BloodPressure,
+            Mental, Physical, Happiness
+        FROM HealthMetrics
+        WHERE CustSsn = %s
+        """
+        try:
+            return await self._fetch_dataframe(query, db_name, (cust_ssn,))
+        except aiomysql.Error as err:
+            print(f"Error fetching data for user {cust_ssn}: {err}")
+            return pd.DataFrame()
+
+    async def update_health_metrics(self, cust_ssn, mental, physical, happiness, db_name):
+        """
+        Update the health metrics (mental, physical, happiness) for a specific customer.
+        Args:
+            cust_ssn (int): Customer SSN.
+            mental (int): Mental health score.
+            physical (int): Physical health score.
+            happiness (int): Happiness score.
+            db_name (str): Database name.
+        """
+        query = """
+            UPDATE HealthMetrics
+            SET Mental = %s,
+                Physical = %s,
+                Happiness = %s
+            WHERE CustSsn = %s
+        """
+        try:
+            await self._execute_many(query, [(mental, physical, happiness, cust_ssn)], db_name)
+        except aiomysql.Error as err:
+            print(f"Error updating health metrics: {err}")
+
+    async def insert_dataframe(self, table_name, dataframe, db_name):
+        """Insert data from a pandas DataFrame into a specified table."""
+        columns = ", ".join(dataframe.columns)
+        placeholders = ", ".join(["%s"] * len(dataframe.columns))
+        query = f"INSERT INTO {table_name} ({columns}) VALUES ({placeholders})"
+        try:
+            await self._execute_many(query, dataframe.values.tolist(), db_name)
+        except aiomysql.Error as err:
+            print(f"Error: {err}")
+
+    async def update_clustering_results(self, data, db_name):
+        """
+        Update prediction results in the database.
+        Args:
+            data (DataFrame): DataFrame containing the predictions with CustSsn as the key.
+            db_name (str): Database name.
+        """
+        query = """
+        UPDATE ChronicDiseaseRisk
+        SET
+            PredictionDate = CURDATE(),
+            AtRisk = %s,
+            RiskLevel = %s,
+            ConfidenceScore = %s
+        WHERE CustSsn = %s
+        """
+        update_data = list(zip(
+            data["AtRisk"].tolist(),
+            data["RiskLevel"].tolist(),
+            data["ConfidenceScore"].tolist(),
+            data["CustSsn"].tolist()
+        ))
+        try:
+            await self._execute_many(query, update_data, db_name)
+        except aiomysql.Error as err:
+            print(f"Error updating clustering results: {err}")
+
+    async def recommend_products(self, client_ssn, db_name):
+        """
+        Recommend a product for the given client based on their risk level.
+        - client_ssn: The SSN of the client.
+        """
+        try:
+            pool = await self._get_pool(db_name)
+            async with pool.acquire() as connection:
+                async with connection.cursor() as cursor:
+                    await cursor.execute(
+                        "SELECT RiskLevel FROM ChronicDiseaseRisk WHERE CustSsn = %s",
+                        (client_ssn,)
+                    )
+                    risk_level_data = await cursor.fetchone()
+
+                    if not risk_level_data:
+                        print(f"No risk level found for client {client_ssn}.")
+                        return None
+
+                    # Map risk level (0-100) to 0-5
+                    mapped_risk_level = risk_level_data[0] // (100/6)
+
+                    await cursor.execute(
+                        "SELECT SeriesName, PlanName FROM Product WHERE RiskLevel = %s LIMIT 1",
+                        (mapped_risk_level,)
+                    )
+                    product = await cursor.fetchone()
+
+                    if not product:
+                        print(f"No products available for mapped risk level {mapped_risk_level}.")
+                        return None
+
+                    await cursor.execute(
+                        "SELECT CustFirstName, CustLastName FROM Customer WHERE CustSsn = %s",
+                        (client_ssn,)
+                    )
+                    customer_name = await cursor.fetchone()
+
+                    if not customer_name:
+                        print(f"No customer found with SSN {client_ssn}.")
+                        return None
+        except aiomysql.Error as err:
+            print(f"Error: {err}")
+            return None
+
+        full_name = f"{customer_name[0]} {customer_name[1]}"
+        series_name, plan_name = product
+        recommendation_message = f"\nHi {full_name}. Thanks for your patience! The recommendation for you is the product '{series_name}' under the plan '{plan_name}'."
+
+        print(recommendation_message)
+        return recommendation_message
+
+    async def close_pools(self):
+        """Close every pool and wait for its connections to shut down."""
+        async with self._pool_lock:
+            pools = list(self.pools.values())
+            self.pools.clear()
+        for pool in pools:
+            pool.close()
+            await pool.wait_closed()
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Xueyao Zhao
+"""
+
+import contextlib
+import io
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+
+class BenchmarkAPI:
+    def __init__(self, insurance_api, db_name):
+        """
+        Initialize the benchmark against an already populated database.
+        Args:
+            insurance_api (InsuranceAPI): The API object under test (shared by every worker).
+            db_name (str): Database name.
+        """
+        self.insurance_api = insurance_api
+        self.db_name = db_name
+
+    def stress_test(self, client_ssns, num_calls=500, num_workers=32):
+        """
+        Run concurrent recommend_products and update_health_metrics calls through one shared InsuranceAPI
+        and check every result against the customer it was requested for, so connections or cursors
+        crossing threads show up as mismatches.
+        Args:
+            client_ssns (list): Customer SSNs that already have a ChronicDiseaseRisk row.
+            num_calls (int): Total number of calls, split evenly between the two methods.
+            num_workers (int): Size of the thread pool.
+        Returns:
+            dict: Call counts, recommendations that found no product, mismatched results, exceptions
+                  (as "function: error" strings), wall time and calls per second.
+        """
+        names = {
+            cust_ssn: f"{first_name} {last_name}"
+            for cust_ssn, first_name, last_name in self.insurance_api.run_custom_query(
+                "SELECT CustSsn, CustFirstName, CustLastName FROM Customer WHERE CustSsn IN ("
+                + ", ".join(str(int(cust_ssn)) for cust_ssn in set(client_ssns)) + ")",
+                self.db_name
+            )
+        }
+        # One lock per customer, so no other worker updates its metrics between a write and its read-back
+        customer_locks = {cust_ssn: threading.Lock() for cust_ssn in set(client_ssns)}
+
+        def recommend(cust_ssn):
+            message = self.insurance_api.recommend_products(cust_ssn, self.db_name)
+            if message is None:
+                return "no_product"  # Tier without a product, not a failure
+            return "ok" if f"Hi {names.get(cust_ssn)}." in message else "mismatch"
+
+        def update(cust_ssn):
+            scores = tuple(random.randint(-10, 10) for _ in range(3))
+            with customer_locks[cust_ssn]:
+                self.insurance_api.update_health_metrics(cust_ssn, *scores, db_name=self.db_name)
+                # Read the rows back on the same shared object: another thread's connection would return other values
+                rows = self.insurance_api.run_custom_query(
+                    "SELECT Mental, Physical, Happiness FROM HealthMetrics WHERE CustSsn = %s",
+                    self.db_name, (cust_ssn,)
+                )
+            return "ok" if rows and all(tuple(row) == scores for row in rows) else "mismatch"
+
+        jobs = [
+            (recommend if i % 2 == 0 else update, random.choice(client_ssns))
+            for i in range(num_calls)
+        ]
+
+        start = time.perf_counter()
+        outcomes = []
+        errors = []
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            futures = [(func.__name__, executor.submit(func, cust_ssn)) for func, cust_ssn in jobs]
+            for name, future in futures:
+                try:
+                    outcomes.append(future.result())
+                except Exception as err:
+                    errors.append(f"{name}: {err!r}")
+        elapsed = time.perf_counter() - start
+
+        return {
+            "calls": num_calls,
+            "no_product": outcomes.count("no_product"),
+            "mismatches": outcomes.count("mismatch"),
+            "errors": errors,
+            "seconds": elapsed,
+            "calls_per_second": num_calls / elapsed if elapsed else float("inf")
+        }
+
+
+    def _latencies(self, func, args_list, repeat):
+        """Time func over every argument tuple in args_list; returns latencies in milliseconds."""
+        latencies = []
+        with contextlib.redirect_stdout(io.StringIO()):  # recommend_products prints every message
+            for _ in range(repeat):
+                for args in args_list:
+                    start = time.perf_counter()
+                    func(*args)
+                    latencies.append((time.perf_counter() - start) * 1000)
+        return pd.Series(latencies)
+
+    def _summarize(self, latencies):
+        """Mean, p50 and p99 of a latency series in milliseconds."""
+        return {
+            "mean_ms": latencies.mean(),
+            "p50_ms": latencies.quantile(0.5),
+            "p99_ms": latencies.quantile(0.99)
+        }
+
+    def compare_prepared_statements(self, client_ssns, repeat=5):
+        """
+        Time recommend_products with and without the prepared-statement cache.
+        Args:
+            client_ssns (list): Customer SSNs to recommend for.
+            repeat (int): Passes over client_ssns per mode.
+        Returns:
+            pd.DataFrame: Latency summary per mode plus the per-call time saved.
+        """
+        args_list = [(cust_ssn, self.db_name) for cust_ssn in client_ssns]
+        original = self.insurance_api.prepared_statements
+        cache = self.insurance_api.recommendation_cache
+        self.insurance_api.recommendation_cache = None  # Time the queries, not cache hits
+        summary = {}
+        try:
+            for prepared in (False, True):
+                self.insurance_api.prepared_statements = prepared
+                self._latencies(self.insurance_api.recommend_products, args_list[:1], 1)  # Warm the pool and cache
+                latencies = self._latencies(self.insurance_api.recommend_products, args_list, repeat)
+                summary["prepared" if prepared else "text"] = self._summarize(latencies)
+        finally:
+            self.insurance_api.prepared_statements = original
+            self.insurance_api.recommendation_cache = cache
+
+        result = pd.DataFrame(summary).T
+        result.loc["saved"] = result.loc["text"] - result.loc["prepared"]
+        return result
+
+    def compare_recommendation_modes(self, client_ssns, repeat=5):
+        """
+        Time recommend_products with the default path (risk level query, tier computed in Python, product and
+        name from the catalog and profile caches) and the single joined query.
+        Args:
+            client_ssns (list): Customer SSNs to recommend for.
+            repeat (int): Passes over client_ssns per mode.
+        Returns:
+            pd.DataFrame: Latency summary per mode plus the per-call time saved.
+        """
+        args_list = [(cust_ssn, self.db_name) for cust_ssn in client_ssns]
+        original = self.insurance_api.single_query_recommendations
+        cache = self.insurance_api.recommendation_cache
+        self.insurance_api.recommendation_cache = None  # Time the queries, not cache hits
+        summary = {}
+        try:
+            for single_query in (False, True):
+                self.insurance_api.single_query_recommendations = single_query
+                self._latencies(self.insurance_api.recommend_products, args_list[:1], 1)  # Warm the pool and caches
+                latencies = self._latencies(self.insurance_api.recommend_products, args_list, repeat)
+                summary["single_query" if single_query else "python_tiering"] = self._summarize(latencies)
+        finally:
+            self.insurance_api.single_query_recommendations = original
+            self.insurance_api.recommendation_cache = cache
+
+        result = pd.DataFrame(summary).T
+        result.loc["saved"] = result.loc["python_tiering"] - result.loc["single_query"]
+        return result
+
+    def check_recommendation_modes(self, client_ssns, risk_levels=None):
+        """
+        Give the clients a sweep of (non-integral) risk levels and check that recommend_products, its
+        single-query mode and recommend_products_batch recommend the same product for every one of them.
+        The clients' ChronicDiseaseRisk rows are restored afterwards (ChronicDiseaseRiskHistory keeps the sweep).
+        Args:
+            client_ssns (list): Customer SSNs that already have a ChronicDiseaseRisk row.
+            risk_levels (list): Risk levels to try; defaults to values on and next to every tier boundary
+                                plus a grid of non-integral levels.
+        Returns:
+            int: Number of risk levels compared.
+        Raises:
+            AssertionError: The modes disagree for some risk level.
+        """
+        api = self.insurance_api
+        if risk_levels is None:
+            boundaries = [tier * (100/6) for tier in range(1, 6)]
+            risk_levels = sorted(
+                {level for b in boundaries for level in (np.nextafter(b, 0), b, np.nextafter(b, 100), b - 1e-3, b + 1e-3)}
+                | set(np.round(np.arange(0.0, 100.0, 0.37), 3).tolist()) | {0.0, 33.636, 99.999, 100.0}
+            )
+        client_ssns = list(client_ssns)
+        original_rows = api.run_custom_query(
+            "SELECT CustSsn, AtRisk, RiskLevel, ConfidenceScore FROM ChronicDiseaseRisk WHERE CustSsn IN ("
+            + ", ".join(str(int(cust_ssn)) for cust_ssn in client_ssns) + ")",
+            self.db_name
+        )
+        original = pd.DataFrame(original_rows, columns=["CustSsn", "AtRisk", "RiskLevel", "ConfidenceScore"])
+        cache, single_query = api.recommendation_cache, api.single_query_recommendations
+        api.recommendation_cache = None  # Every call must run its mode's queries
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):  # recommend_products prints every message
+                for start in range(0, len(risk_levels), len(client_ssns)):
+                    levels = risk_levels[start:start + len(client_ssns)]
+                    clients = client_ssns[:len(levels)]
+                    api.update_clustering_results(pd.DataFrame({
+                        "CustSsn": clients,
+                        "AtRisk": [level > 50 for level in levels],
+                        "RiskLevel": levels,
+                        "ConfidenceScore": [0.0] * len(levels)
+                    }), self.db_name)
+                    batch = api.recommend_products_batch(clients, self.db_name).set_index("CustSsn")["Message"]
+                    for cust_ssn, level in zip(clients, levels):
+                        api.single_query_recommendations = False
+                        default_message = api.recommend_products(cust_ssn, self.db_name)
+                        api.single_query_recommendations = True
+                        single_message = api.recommend_products(cust_ssn, self.db_name)
+                        batch_message = batch.get(cust_ssn)
+                        assert default_message == single_message == batch_message, (
+                            f"RiskLevel {level!r}: default {default_message!r}, single query {single_message!r}, "
+                            f"batch {batch_message!r}"
+                        )
+        finally:
+            api.single_query_recommendations = single_query
+            api.recommendation_cache = cache
+            with contextlib.redirect_stdout(io.StringIO()):
+                api.update_clustering_results(original, self.db_name)
+        return len(risk_levels)
+
+    def compare_inference(self, ml_api, unlabeled_data, repeat=200):
+        """
+        Time single-row scoring with sklearn's predict_proba and with the flattened forest.
+        Args:
+            ml_api (MLAPI): Trained model to score with.
+            unlabeled_data (DataFrame): Rows to score one at a time (as from fetch_unlabeled_data).
+            repeat (int): Passes over the rows per engine.
+        Returns:
+            pd.DataFrame: Latency summary per engine plus the per-row time saved.
+        Raises:
+            AssertionError: The engines disagree on any probability.
+        """
+        features = unlabeled_data[ml_api.feature_columns].to_numpy(dtype=np.float32)
+        rows = [features[i:i + 1] for i in range(len(features))]
+        flat_forest = ml_api.get_flat_forest()
+        for row in rows:
+            assert np.array_equal(ml_api.model.predict_proba(row), flat_forest.predict_proba(row))
+
+        summary = {
+            "sklearn": self._summarize(self._latencies(ml_api.model.predict_proba, [(row,) for row in rows], repeat)),
+            "flat": self._summarize(self._latencies(flat_forest.predict_proba, [(row,) for row in rows], repeat))
+        }
+        result = pd.DataFrame(summary).T
+        result.loc["saved"] = result.loc["sklearn"] - result.loc["flat"]
+        return result
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Xueyao Zhao
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class RecommendationCache:
+    """Thread-safe LRU cache with a time-to-live, keyed by (database name, CustSsn)."""
+
+    def __init__(self, max_size=10000, ttl=300):
+        """
+        Args:
+            max_size (int): Entries kept before the least recently used one is evicted.
+            ttl (float): Seconds an entry stays valid (None keeps entries until evicted or invalidated).
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # (db_name, cust_ssn) -> (expires_at, value)
+        self._generation = 0  # Bumped on every invalidation so values computed before it are not stored
+        self._lock = threading.Lock()
+
+    def get(self, db_name, cust_ssn):
+        """
+        Look up a cached value.
+        Returns:
+            tuple: (value or None, token); pass the token to put once the value has been computed.
+        """
+        key = (db_name, int(cust_ssn))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value, self._generation
+                del self._entries[key]
+            self.misses += 1
+            return None, self._generation
+
+    def put(self, db_name, cust_ssn, value, token):
+        """Store a value unless an invalidation happened after the get that returned token."""
+        key = (db_name, int(cust_ssn))
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            if token != self._generation:
+                return
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, db_name, cust_ssns):
+        """Drop the entries of the given customers."""
+        with self._lock:
+            self._generation += 1
+            for cust_ssn in cust_ssns:
+                self._entries.pop((db_name, int(cust_ssn)), None)
+
+    def clear(self, db_name=None):
+        """Drop every entry of db_name, or of every database when db_name is None."""
+        with self._lock:
+            self._generation += 1
+            if db_name is None:
+                self._entries.clear()
+                return
+            for key in [key for key in self._entries if key[0] == db_name]:
+                del self._entries[key]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Xueyao Zhao
+"""
+
+import json
+import os
+import threading
+
+import numpy as np
+
+from MLAPI import FEATURE_COLUMNS
+
+UNLABELED = -1  # labels value of customers without a ChronicDiseaseHistory row
+
+
+class FeatureStore:
+    """
+    Model features of every customer in a float32 memmap, one row per CustSsn.
+    Labeled rows come first and undetermined rows after them, so training and scoring read a
+    contiguous slice of the map instead of querying the database and building a DataFrame.
+    """
+
+    def __init__(self, directory, feature_columns=FEATURE_COLUMNS):
+        """
+        Open the store in directory, or create an empty one.
+        Args:
+            directory (str): Where features.f32, cust_ssn.i64, labels.i8 and meta.json live.
+            feature_columns (list): Column order of the feature matrix (must match the model's).
+        """
+        self.directory = directory
+        self.feature_columns = list(feature_columns)
+        self._column_index = {column: i for i, column in enumerate(self.feature_columns)}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        meta_path = os.path.join(directory, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta["feature_columns"] != self.feature_columns:
+                raise ValueError("Feature store was built with different feature columns")
+            self.rows, self.labeled, capacity = meta["rows"], meta["labeled"], meta["capacity"]
+            self.pending_labels = {int(cust_ssn): label for cust_ssn, label in meta.get("pending_labels", {}).items()}
+        else:
+            self.rows, self.labeled, capacity = 0, 0, 0
+            self.pending_labels = {}  # Labels of customers diagnosed before their HealthMetrics row arrived
+        self._map(capacity)
+        self.index = {int(cust_ssn): row for row, cust_ssn in enumerate(self.cust_ssn[:self.rows])}
+
+    def _map(self, capacity):
+        """(Re)map the three arrays with room for capacity rows, growing the files if needed."""
+        self.capacity = capacity
+        shape = max(capacity, 1)  # np.memmap cannot map an empty file
+        self.features = self._open("features.f32", np.float32, (shape, len(self.feature_columns)))
+        self.cust_ssn = self._open("cust_ssn.i64", np.int64, (shape,))
+        self.labels = self._open("labels.i8", np.int8, (shape,))
+
+    def _open(self, name, dtype, shape):
+        path = os.path.join(self.directory, name)
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        with open(path, "ab") as f:
+            if f.tell() < size:
+                f.truncate(size)
+        return np.memmap(path, dtype=dtype, mode="r+", shape=shape)
+
+    def _reserve(self, rows):
+        """Make room for rows in total, doubling the capacity to keep appends amortized O(1)."""
+        if rows > self.capacity:
+            self.flush()
+            self._map(max(rows, 2 * self.capacity, 1024))
+
+    def flush(self):
+        """Write the maps and the row counts to disk."""
+        for array in (self.features, self.cust_ssn, self.labels):
+            array.flush()
+        meta = {
+            "feature_columns": self.feature_columns,
+            "rows": self.rows,
+            "labeled": self.labeled,
+            "capacity": self.capacity,
+            "pending_labels": {str(cust_ssn): label for cust_ssn, label in self.pending_labels.items()}
+        }
+        with open(os.path.join(self.directory, "meta.json.tmp"), "w") as f:
+            json.dump(meta, f)
+        os.replace(os.path.join(self.directory, "meta.json.tmp"), os.path.join(self.directory, "meta.json"))
+
+    def build(self, training_data, unlabeled_data):
+        """
+        Replace the contents with freshly fetched data.
+        Args:
+            training_data (DataFrame): Labeled rows, as from InsuranceAPI.fetch_training_data.
+            unlabeled_data (DataFrame): Undetermined rows, as from InsuranceAPI.fetch_unlabeled_data.
+        """
+        # A customer with several HealthMetrics rows keeps the last one
+        training_data = training_data.drop_duplicates("CustSsn", keep="last")
+        unlabeled_data = unlabeled_data.drop_duplicates("CustSsn", keep="last")
+        with self._lock:
+            self.rows = self.labeled = 0
+            self._reserve(len(training_data) + len(unlabeled_data))
+            labeled = len(training_data)
+            self.features[:labeled] = training_data[self.feature_columns].to_numpy(dtype=np.float32)
+            self.features[labeled:labeled + len(unlabeled_data)] = unlabeled_data[self.feature_columns].to_numpy(dtype=np.float32)
+            self.cust_ssn[:labeled] = training_data["CustSsn"].to_numpy()
+            self.cust_ssn[labeled:labeled + len(unlabeled_data)] = unlabeled_data["CustSsn"].to_numpy()
+            self.labels[:labeled] = training_data["HasChronicDisease"].to_numpy()
+            self.labels[labeled:labeled + len(unlabeled_data)] = UNLABELED
+            self.rows, self.labeled = labeled + len(unlabeled_data), labeled
+            self.pending_labels = {}
+            self.index = {int(cust_ssn): row for row, cust_ssn in enumerate(self.cust_ssn[:self.rows])}
+            self.flush()
+
+    def training_arrays(self):
+        """Features and labels of the labeled customers, as views of the maps (no copy)."""
+        return self.features[:self.labeled], self.labels[:self.labeled]
+
+    def scoring_arrays(self, cust_ssns=None):
+        """
+        CustSsn values and features to score.
+        Args:
+            cust_ssns (list): Customers to return (copied rows), or None for every undetermined
+                              customer as views of the maps (no copy).
+        Returns:
+            tuple: (CustSsn array, feature matrix).
+        """
+        if cust_ssns is None:
+            return self.cust_ssn[self.labeled:self.rows], self.features[self.labeled:self.rows]
+        rows = [self.index[int(cust_ssn)] for cust_ssn in cust_ssns if int(cust_ssn) in self.index]
+        return self.cust_ssn[rows], self.features[rows]
+
+    def update(self, cust_ssn, values):
+        """
+        Overwrite some features of a customer in place.
+        Args:
+            cust_ssn (int): Customer SSN; customers not in the store are ignored.
+            values (dict): Feature column -> new value.
+        """
+        with self._lock:
+            row = self.index.get(int(cust_ssn))
+            if row is None:
+                return
+            for column, value in values.items():
+                self.features[row, self._column_index[column]] = value
+
+    def upsert(self, dataframe):
+        """
+        Write the features of the customers in dataframe; unknown customers are appended as undetermined,
+        or as labeled when set_labels already recorded their diagnosis.
+        Args:
+            dataframe (DataFrame): CustSsn and the feature columns (as inserted into HealthMetrics).
+        """
+        with self._lock:
+            self._reserve(self.rows + len(dataframe))
+            features = dataframe[self.feature_columns].to_numpy(dtype=np.float32)
+            for cust_ssn, row_features in zip(dataframe["CustSsn"].to_numpy().tolist(), features):
+                row = self.index.get(cust_ssn)
+                if row is None:
+                    row = self.rows
+                    self.cust_ssn[row] = cust_ssn
+                    self.labels[row] = UNLABELED
+                    self.index[cust_ssn] = row
+                    self.rows += 1
+                    if cust_ssn in self.pending_labels:
+                        row = self._label(row, self.pending_labels.pop(cust_ssn))
+                self.features[row] = row_features
+            self.flush()
+
+    def set_labels(self, cust_ssns, labels):
+        """
+        Record diagnoses; an undetermined customer's row is swapped to the end of the labeled block
+        so both blocks stay contiguous. Labels of customers not in the store yet are kept until upsert adds them.
+        Args:
+            cust_ssns (list): Customer SSNs.
+            labels (list): HasChronicDisease values (0 or 1) in the same order.
+        """
+        with self._lock:
+            for cust_ssn, label in zip(cust_ssns, labels):
+                row = self.index.get(int(cust_ssn))
+                if row is None:
+                    self.pending_labels[int(cust_ssn)] = int(label)
+                    continue
+                self._label(row, label)
+            self.flush()
+
+    def _label(self, row, label):
+        """Set the label of a row, moving it into the labeled block first; returns the row's new index."""
+        if row >= self.labeled:
+            boundary = self.labeled
+            self._swap(row, boundary)
+            row = boundary
+            self.labeled += 1
+        self.labels[row] = label
+        return row
+
+    def _swap(self, a, b):
+        if a == b:
+            return
+        for array in (self.features, self.cust_ssn, self.labels):
+            array[[a, b]] = array[[b, a]]
+        self.index[int(self.cust_ssn[a])] = a
+        self.index[int(self.cust_ssn[b])] = b
+
+    def __len__(self):
+        return self.rows
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Xueyao Zhao
+"""
+
+import os
+
+import numpy as np
+
+
+class FlatForest:
+    """
+    A fitted RandomForestClassifier flattened into NumPy node arrays, evaluated for all trees at once.
+    Meant for single rows and small batches, where sklearn's per-call validation and per-tree dispatch
+    cost more than the tree walks themselves.
+    """
+
+    ARRAYS = ["feature", "threshold", "left", "right", "missing_left", "value", "roots", "classes"]
+
+    def __init__(self, feature, threshold, left, right, missing_left, value, roots, classes, max_depth):
+        """
+        Args:
+            feature, threshold (ndarray): Split feature and threshold of every node of every tree.
+            left, right (ndarray): Global index of each node's children; leaves point at themselves.
+            missing_left (ndarray): Whether a NaN feature value goes to the left child (sklearn's missing_go_to_left).
+            value (ndarray): Class probabilities of every node (n_nodes, n_classes).
+            roots (ndarray): Global index of each tree's root node.
+            classes (ndarray): Class labels, in the column order of value.
+            max_depth (int): Depth of the deepest tree.
+        """
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.missing_left = missing_left
+        self.value = value
+        self.roots = roots
+        self.classes = classes
+        self.max_depth = max_depth
+
+    @classmethod
+    def from_model(cls, model):
+        """
+        Flatten a fitted single-output RandomForestClassifier.
+        Args:
+            model (RandomForestClassifier): The forest to export.
+        Returns:
+            FlatForest: Node arrays of every tree concatenated in estimator order.
+        """
+        features, thresholds, lefts, rights, missing_lefts, values, roots = [], [], [], [], [], [], []
+        offset = 0
+        for estimator in model.estimators_:
+            tree = estimator.tree_
+            nodes = np.arange(tree.node_count)
+            is_leaf = tree.children_left == -1
+            features.append(np.where(is_leaf, 0, tree.feature))
+            thresholds.append(tree.threshold)
+            lefts.append(np.where(is_leaf, nodes, tree.children_left) + offset)
+            rights.append(np.where(is_leaf, nodes, tree.children_right) + offset)
+            missing_lefts.append(tree.missing_go_to_left.astype(bool))
+            values.append(tree.value[:, 0, :model.n_classes_])  # Already class fractions per node
+            roots.append(offset)
+            offset += tree.node_count
+        return cls(
+            feature=np.concatenate(features).astype(np.intp),
+            threshold=np.concatenate(thresholds),
+            left=np.concatenate(lefts).astype(np.intp),
+            right=np.concatenate(rights).astype(np.intp),
+            missing_left=np.concatenate(missing_lefts),
+            value=np.ascontiguousarray(np.concatenate(values)),
+            roots=np.array(roots, dtype=np.intp),
+            classes=model.classes_,
+            max_depth=max(estimator.tree_.max_depth for estimator in model.estimators_)
+        )
+
+    def predict_proba(self, X):
+        """
+        Class probabilities, identical to RandomForestClassifier.predict_proba with n_jobs=None.
+        Args:
+            X (ndarray): Feature rows (n_samples, n_features), columns in training order.
+        Returns:
+            ndarray: Probabilities (n_samples, n_classes).
+        """
+        # sklearn casts to float32 and compares the float32 value against the float64 threshold
+        X = np.asarray(X, dtype=np.float32).astype(np.float64)
+        rows = np.arange(X.shape[0])[:, None]
+        nodes = np.broadcast_to(self.roots, (X.shape[0], self.roots.shape[0]))
+        for _ in range(self.max_depth):  # Rows that reached a leaf keep pointing at it
+            values = X[rows, self.feature[nodes]]
+            go_left = np.where(np.isnan(values), self.missing_left[nodes], values <= self.threshold[nodes])
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+
+        leaf_values = self.value[nodes]  # (n_samples, n_trees, n_classes)
+        proba = np.zeros((X.shape[0], self.value.shape[1]))
+        for tree in range(self.roots.shape[0]):  # Sum in estimator order, as sklearn does
+            proba += leaf_values[:, tree]
+        proba /= self.roots.shape[0]
+        return proba
+
+    def predict(self, X):
+        """Predicted class labels, as RandomForestClassifier.predict."""
+        return self.classes.take(np.argmax(self.predict_proba(X), axis=1))
+
+    def save(self, directory):
+        """Write every array as a .npy file so load can memory-map them."""
+        os.makedirs(directory, exist_ok=True)
+        for name in self.ARRAYS:
+            np.save(os.path.join(directory, f"{name}.npy"), getattr(self, name))
+        np.save(os.path.join(directory, "max_depth.npy"), np.array(self.max_depth))
+
+    @classmethod
+    def load(cls, directory):
+        """
+        Memory-map a forest written by save; the node arrays are paged in on use rather than copied.
+        Raises:
+            FileNotFoundError: directory holds no saved forest.
+        """
+        # asarray drops the np.memmap subclass (whose ufunc overhead dominates small batches) but keeps the mapping
+        arrays = {
+            name: np.asarray(np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r"))
+            for name in cls.ARRAYS
+        }
+        max_depth = int(np.load(os.path.join(directory, "max_depth.npy")))
+        return cls(max_depth=max_depth, **arrays)
@@ -3,64 +3,172 @@
 @author: Xueyao Zhao
 """
 
-import mysql.connector
+import numpy as np
 import pandas as pd
+import contextlib
+import math
+import os
 import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from storageAPI import MySQLBackend
+from metricsAPI import REGISTRY, InstrumentedCursor, instrumented
 
 class InsuranceAPI:
-    def __init__(self, host, user, password):
-        """Initialize the connection settings."""
-        self.host = host
-        self.user = user
-        self.password = password
-        self.connection = None
-        self.cursor = None
+    def __init__(self, host=None, user=None, password=None, pool_size=5, pool_timeout=10, pool_ping=True,
+                 allow_local_infile=False, risk_history=False, backend=None, prepared_statements=True,
+                 materialized_views=False, metrics=None, single_query_recommendations=False,
+                 recommendation_cache=None):
+        """
+        Initialize the connection settings.
+        Args:
+            pool_size (int): Connections kept open per database (MySQL caps this at 32).
+            pool_timeout (float): Seconds to wait for a free pooled connection before giving up.
+            pool_ping (bool): Ping checked-out connections and reconnect them if the server dropped them.
+            allow_local_infile (bool): Allow LOAD DATA LOCAL INFILE for bulk_insert_dataframe (the server must enable local_infile too).
+            risk_history (bool): Also append every prediction written to ChronicDiseaseRisk to ChronicDiseaseRiskHistory.
+            backend: Storage backend from storageAPI (e.g. SQLiteBackend, DuckDBBackend). Defaults to a
+                     pooled MySQLBackend built from host, user, password and the pool settings.
+            prepared_statements (bool): Run the hot lookup queries through the per-connection prepared-statement cache.
+            materialized_views (bool): Track changed customers on every write and serve training, scoring and
+                                       undetermined-client reads from incrementally refreshed materialized views.
+            metrics (MetricsRegistry): Where per-call timings are recorded (and the slow-query threshold is set).
+                                       Defaults to the process-wide metricsAPI.REGISTRY.
+            single_query_recommendations (bool): Have recommend_products fetch the risk tier, product and customer
+                                                 name in one joined query (one round trip instead of three).
+            recommendation_cache (RecommendationCache): Serve repeat recommend_products calls from this cache.
+                                                        Entries are dropped when the customer's prediction or the
+                                                        Product table is written through this object.
+        """
+        if backend is None:
+            backend = MySQLBackend(host, user, password, pool_size=pool_size, pool_timeout=pool_timeout,
+                                   pool_ping=pool_ping, allow_local_infile=allow_local_infile)
+        self.backend = backend
+        self.Error = backend.Error  # Exception type raised by the backend's driver
+        self.risk_history = risk_history
+        self.prepared_statements = prepared_statements
+        self.materialized_views = materialized_views
+        self._view_lock = threading.Lock()  # Serializes refreshes from this process
+        self.metrics = metrics or REGISTRY
+        self._product_catalogs = {}  # db_name -> list of (SeriesName, PlanName) or None, indexed by risk tier 0-5
+        self._catalog_versions = {}  # db_name -> bumped on every Product write, so stale loads are not cached
+        self._catalog_lock = threading.Lock()
+        self.single_query_recommendations = single_query_recommendations
+        self._single_recommendation_query = None  # Built on first use by _recommend_products_single_query
+        self.recommendation_cache = recommendation_cache
+        self._profiles = {}  # db_name -> {CustSsn: profile dict}, see get_customer_profile
+        self._profile_generation = 0  # Bumped on every invalidation, so loads that raced with a write are not cached
+        self._profile_lock = threading.Lock()
+        self.feature_stores = {}  # db_name -> FeatureStore kept current by the write methods
+        # Serializes UndeterminedPool changes from this process. Always taken before the transaction locks any
+        # rows (writers to the pool's source tables take it before their INSERT), so it cannot wait on a row
+        # lock held by a transaction that is itself waiting for it; reentrant for the maintenance helpers.
+        self._undetermined_lock = threading.RLock()
+        self._local = threading.local()  # Each thread checks out its own connection and cursor
+
+    @property
+    def connection(self):
+        """The connection checked out by the calling thread."""
+        return getattr(self._local, "connection", None)
+
+    @connection.setter
+    def connection(self, value):
+        self._local.connection = value
+
+    @property
+    def cursor(self):
+        """The cursor opened by the calling thread."""
+        return getattr(self._local, "cursor", None)
+
+    @cursor.setter
+    def cursor(self, value):
+        self._local.cursor = value
 
     def connect(self, db_name=None):
-        """Connect to MySQL server and optionally to a specific database."""
-        if db_name:
-            self.connection = mysql.connector.connect(
-                host=self.host,
-                user=self.user,
-                password=self.password,
-                database=db_name  # Connect directly to the specified database
-            )
+        """Check out a connection from the backend, optionally bound to a specific database."""
+        start = time.perf_counter()
+        self.connection = self.backend.connect(db_name)
+        record = self.metrics.current()
+        if record:
+            record.connect += time.perf_counter() - start
+        self.cursor = InstrumentedCursor(self.backend.cursor(self.connection), self.metrics)
+
+    def _execute(self, query, params):
+        """
+        Run a hot-path query with bound parameters on the calling thread's connection.
+        Returns the cursor; result rows must be read with fetchall() before the next statement.
+        """
+        if self.prepared_statements:
+            query = sys.intern(query)  # A prepared cursor reuses its statement only for the identical string
+            cursor = InstrumentedCursor(self.backend.prepared_cursor(self.connection, query), self.metrics)
         else:
-            self.connection = mysql.connector.connect(
-                host=self.host,
-                user=self.user,
-                password=self.password
-            )
-        self.cursor = self.connection.cursor()
+            cursor = self.cursor
+        cursor.execute(query, params)
+        return cursor
 
+    def _stream_dataframes(self, query, db_name, chunksize, error_message, method_name):
+        """
+        Yield the result of query as DataFrames of at most chunksize rows.
+        Rows are read from a streaming cursor on a dedicated connection, so only
+        one chunk is held in memory and other calls can run while the generator is open.
+        """
+        # Recorded apart from the thread's call stack: the consumer runs other calls between chunks
+        record = self.metrics.begin(f"{method_name}[chunked]", track=False)
+        try:
+            start = time.perf_counter()
+            connection = self.backend.connect(db_name)
+            record.connect += time.perf_counter() - start
+        except self.Error as err:
+            print(f"{error_message}: {err}")
+            self.metrics.end(record, track=False)
+            return
+        cursor = InstrumentedCursor(self.backend.stream_cursor(connection), self.metrics, record)
+        try:
+            cursor.execute(query)
+            columns = [col[0] for col in cursor.description]
+            while True:
+                rows = cursor.fetchmany(chunksize)
+                if not rows:
+                    break
+                yield pd.DataFrame(rows, columns=columns)
+        except self.Error as err:
+            print(f"{error_message}: {err}")
+        finally:
+            self.backend.release(connection)
+            self.metrics.end(record, track=False)
+
+    def close_pools(self, db_name=None):
+        """Close the idle pooled connections for db_name, or for every database when omitted."""
+        self.backend.close_pools(db_name)
+
+    @instrumented
     def create_database(self, db_name):
         """Create a database if it doesn't exist."""
-        self.connect()
         try:
-            self.cursor.execute(f"CREATE DATABASE IF NOT EXISTS {db_name}")
+            self.backend.create_database(db_name)
             # print(f"Database '{db_name}' created successfully!")
-            self.cursor.execute(f"USE {db_name}")
-        except mysql.connector.Error as err:
+        except self.Error as err:
             print(f"Error: {err}")
-        finally:
-            self.close_connection()
 
+    @instrumented
     def drop_database(self, db_name):
         """Drop the database if it exists."""
-        self.connect()
         try:
-            self.cursor.execute(f"DROP DATABASE IF EXISTS {db_name}")
+            self.backend.drop_database(db_name)
             # print(f"Database '{db_name}' dropped successfully!")
-        except mysql.connector.Error as err:
+        except self.Error as err:
             print(f"Error: {err}")
-        finally:
-            self.close_connection()
+        self._invalidate_product_catalog(db_name)
+        self._invalidate_customer_profiles(db_name)
 
+    @instrumented
     def create_tables(self, db_name):
         """Create tables in the specified database."""
-        self.connect()
+        self.connect(db_name)
         try:
-            self.cursor.execute(f"USE {db_name}")
             table_creation_queries = table_creation_queries = [
     """
     CREATE TABLE Company (
@@ -214,6 +322,16 @@ class InsuranceAPI:
     """,
     """
     CREATE TABLE ChronicDiseaseRisk (
+        CustSsn INT NOT NULL PRIMARY KEY,  -- Current prediction only: one row per customer
+        PredictionDate DATE,
+        AtRisk BOOLEAN,
+        RiskLevel INT,
+        ConfidenceScore FLOAT,
+        FOREIGN KEY (CustSsn) REFERENCES Customer(CustSsn)
+    )
+    """,
+    """
+    CREATE TABLE ChronicDiseaseRiskHistory (
         RiskID INT AUTO_INCREMENT PRIMARY KEY,
         CustSsn INT NOT NULL,
         PredictionDate DATE,
@@ -253,6 +371,18 @@ class InsuranceAPI:
     NoteContent TEXT NOT NULL,          -- Stores the user's response
     FOREIGN KEY (CustSsn) REFERENCES Customer(CustSsn)
     )
+    """,
+    """
+    CREATE TABLE ViewChangeLog (
+        ChangeID INT AUTO_INCREMENT PRIMARY KEY,
+        CustSsn INT  -- Customer whose view rows are stale; NULL means every view needs a full refresh
+    )
+    """,
+    """
+    CREATE TABLE UndeterminedPool (
+        Slot INT NOT NULL PRIMARY KEY,  -- Dense 1..N, so a random slot is a uniform sample
+        CustSsn INT NOT NULL UNIQUE
+    )
     """
 ]
 
@@ -260,59 +390,215 @@ class InsuranceAPI:
                 self.cursor.execute(query)
                 # print(f"Table created successfully with query: {query.split()[2]}")
 
-        except mysql.connector.Error as err:
+        except self.Error as err:
             print(f"Error: {err}")
         finally:
             self.close_connection()
 
+        # The index set is part of the schema
+        self.add_indexes(db_name)
+        if self.materialized_views:
+            self.create_materialized_views(db_name)
+
+
+    # Indexes backing the lookup and join paths (primary keys such as Customer.CustSsn and
+    # ChronicDiseaseRisk.CustSsn are already indexed and are not repeated here)
+    INDEXES = [
+        "CREATE INDEX idx_health_metrics_cust ON HealthMetrics(CustSsn)",  # training join, per-user fetch, undetermined scans
+        "CREATE INDEX idx_history_cust_status ON ChronicDiseaseHistory(CustSsn, HasChronicDisease)",  # training join, NOT EXISTS
+        "CREATE INDEX idx_product_risk ON Product(RiskLevel)"  # single-query recommendation product lookup
+    ]
+
+    # Queries that must be served by the index set: (name, InsuranceAPI attribute holding the SQL the method
+    # runs, parameters, tables allowed to be fully scanned)
+    INDEXED_QUERIES = [
+        ("training_data", "TRAINING_DATA_QUERY", None, 1),
+        ("unlabeled_data", "UNLABELED_DATA_QUERY", None, 1),
+        ("undetermined_sample", "UNDETERMINED_SAMPLE_QUERY", (1,), 0),
+        ("undetermined_claim", "UNDETERMINED_SLOT_QUERY", (1,), 0),
+        ("undetermined_last_slot", "UNDETERMINED_LAST_SLOT_QUERY", None, 0),
+        ("risk_lookup", "RISK_LEVEL_QUERY", (1,), 0),
+        ("single_query_recommendation", "SINGLE_RECOMMENDATION_QUERY", (1,), 0),
+        ("customer_profile", "CUSTOMER_PROFILE_QUERY", (1,), 0),
+        ("user_metrics", "USER_METRICS_QUERY", (1,), 0)
+    ]
 
+    @instrumented
     def add_indexes(self, db_name):
-        """Add indexes to optimize schema."""
-        self.connect()
+        """Add the workload's index set to the schema (called by create_tables)."""
+        self.connect(db_name)
         try:
-            self.cursor.execute(f"USE {db_name}")
-            index_queries = [
-                "CREATE INDEX idx_cust_ssn ON Customer(CustSsn)",
-                "CREATE INDEX idx_contract_num ON Contract(ContractNum)",
-                "CREATE INDEX idx_health_metrics_date ON HealthMetrics(MetricDate)",
-                "CREATE INDEX idx_diagnosis_date ON ChronicDiseaseHistory(DiagnosisDate)"
-            ]
-            for query in index_queries:
+            for query in self.INDEXES:
                 self.cursor.execute(query)
                 # print(f"Index added: {query.split()[2]}")
-        except mysql.connector.Error as err:
+        except self.Error as err:
             print(f"Error: {err}")
         finally:
             self.close_connection()
 
 
+    @instrumented
+    def check_query_plans(self, db_name):
+        """
+        EXPLAIN the lookup and join queries the methods run and fail if any of them falls back to full table scans.
+        Full-population queries may scan their one driving table; point lookups may scan none.
+        Args:
+            db_name (str): Database name.
+        Returns:
+            dict: Query name -> list of fully scanned tables (None when the backend cannot explain plans).
+        Raises:
+            RuntimeError: If a query scans more tables than it is allowed to.
+        """
+        plans = {}
+        violations = []
+        self.connect(db_name)
+        try:
+            for name, attribute, params, allowed_scans in self.INDEXED_QUERIES:
+                # Fill the templates the way the methods do (one sampled slot)
+                query = getattr(self, attribute).format(slots="%s", risk_tier=self._risk_tier_case("RiskLevel"))
+                scanned = self.backend.scanned_tables(self.cursor, query, params)
+                plans[name] = scanned
+                if scanned is not None and len(scanned) > allowed_scans:
+                    violations.append(f"{name} scans {', '.join(scanned)}")
+        finally:
+            self.close_connection()
+
+        if violations:
+            raise RuntimeError("Queries falling back to full scans: " + "; ".join(violations))
+        return plans
+
+
+    # Materialized views: name -> (customer key, SELECT). {changed} is where incremental refreshes
+    # restrict the SELECT to the customers recorded in ViewChangeLog.
+    MATERIALIZED_VIEWS = {
+        "CustomerPolicyCounts": ("CustSsn", """
+            SELECT CustSsn, COUNT(*) AS PolicyCount
+            FROM Policy
+            WHERE 1 = 1 {changed}
+            GROUP BY CustSsn
+            """),
+        "TrainingFeatures": ("hm.CustSsn", """
+            SELECT 
+                hm.CustSsn, hm.Age, hm.Weight, hm.Height, hm.BMI, 
+                hm.SmokingHabit, hm.DrinkingHabit, hm.ExerciseLevel, 
+                hm.SleepQuality, hm.HeartRate, hm.BloodPressure,
+                hm.Mental, hm.Physical, hm.Happiness,
+                cd.HasChronicDisease
+            FROM HealthMetrics hm
+            INNER JOIN ChronicDiseaseHistory cd
+            ON hm.CustSsn = cd.CustSsn
+            WHERE cd.HasChronicDisease IN (1, 0) {changed}
+            """),
+        "UndeterminedCustomers": ("hm.CustSsn", """
+            SELECT 
+                hm.CustSsn, c.CustFirstName, c.CustLastName,
+                hm.Age, hm.BMI, hm.Weight, hm.Height, hm.SmokingHabit, 
+                hm.DrinkingHabit, hm.ExerciseLevel, hm.SleepQuality, hm.HeartRate, hm.BloodPressure,
+                hm.Mental, hm.Physical, hm.Happiness
+            FROM HealthMetrics hm
+            JOIN Customer c ON hm.CustSsn = c.CustSsn
+            WHERE NOT EXISTS (
+                SELECT 1
+                FROM ChronicDiseaseHistory cd
+                WHERE cd.CustSsn = hm.CustSsn
+            ) {changed}
+            """)
+    }
+
+    # Tables whose writes make view rows stale
+    VIEW_SOURCE_TABLES = {"Customer", "HealthMetrics", "ChronicDiseaseHistory", "Policy"}
+
+    @instrumented
     def create_materialized_views(self, db_name):
-        """Create materialized views for frequent aggregations."""
-        self.connect()
+        """Create (or rebuild) the materialized views and clear the change log they cover."""
+        self.connect(db_name)
         try:
-            self.cursor.execute(f"USE {db_name}")
-            view_queries = [
-                """
-                CREATE TABLE CustomerPolicyCounts AS
-                SELECT CustSsn, COUNT(*) AS PolicyCount
-                FROM Policy
-                GROUP BY CustSsn
-                """
-            ]
-            for query in view_queries:
-                self.cursor.execute(query)
-                # print(f"Materialized view created: {query.split()[2]}")
-        except mysql.connector.Error as err:
+            self.cursor.execute("SELECT MAX(ChangeID) FROM ViewChangeLog")
+            last_change = self.cursor.fetchall()[0][0]
+            for view_name, (key, select) in self.MATERIALIZED_VIEWS.items():
+                self.cursor.execute(f"DROP TABLE IF EXISTS {view_name}")
+                self.cursor.execute(f"CREATE TABLE {view_name} AS " + select.format(changed=""))
+                self.cursor.execute(f"CREATE INDEX idx_{view_name.lower()}_cust ON {view_name}(CustSsn)")
+                # print(f"Materialized view created: {view_name}")
+            if last_change is not None:
+                self.cursor.execute("DELETE FROM ViewChangeLog WHERE ChangeID <= %s", (last_change,))
+            self.connection.commit()
+        except self.Error as err:
             print(f"Error: {err}")
         finally:
             self.close_connection()
 
 
+    @instrumented
+    def refresh_materialized_views(self, db_name, incremental=True):
+        """
+        Bring the materialized views up to date with the changes recorded in ViewChangeLog.
+        Args:
+            db_name (str): Database name.
+            incremental (bool): Recompute only the rows of changed customers. A full refresh is
+                                used anyway when a change could not be tied to a customer.
+        Returns:
+            int: Number of change-log entries applied.
+        """
+        with self._view_lock:
+            self.connect(db_name)
+            try:
+                self.cursor.execute("""
+                SELECT MAX(ChangeID), COUNT(*), SUM(CASE WHEN CustSsn IS NULL THEN 1 ELSE 0 END)
+                FROM ViewChangeLog
+                """)
+                last_change, change_count, untracked = self.cursor.fetchall()[0]
+                if not change_count and incremental:
+                    return 0
+
+                full = not incremental or bool(untracked)
+                changed_customers = "(SELECT CustSsn FROM ViewChangeLog WHERE ChangeID <= %s)"
+                for view_name, (key, select) in self.MATERIALIZED_VIEWS.items():
+                    if full:
+                        self.cursor.execute(f"DELETE FROM {view_name}")
+                        self.cursor.execute(f"INSERT INTO {view_name} " + select.format(changed=""))
+                    else:
+                        # Replace just the changed customers' rows
+                        self.cursor.execute(
+                            f"DELETE FROM {view_name} WHERE CustSsn IN {changed_customers}", (last_change,)
+                        )
+                        self.cursor.execute(
+                            f"INSERT INTO {view_name} " + select.format(changed=f"AND {key} IN {changed_customers}"),
+                            (last_change,)
+                        )
+                if last_change is not None:
+                    self.cursor.execute("DELETE FROM ViewChangeLog WHERE ChangeID <= %s", (last_change,))
+                self.connection.commit()
+                return change_count
+            except self.Error as err:
+                self.connection.rollback()
+                print(f"Error refreshing materialized views: {err}")
+                return 0
+            finally:
+                self.close_connection()
+
+
+    def _log_changes(self, table_name, cust_ssns):
+        """
+        Record the customers touched by a write to a view source table (current connection, same transaction).
+        cust_ssns is None when the written rows have no CustSsn yet.
+        """
+        if not self.materialized_views or table_name not in self.VIEW_SOURCE_TABLES:
+            return
+        if cust_ssns is not None:
+            changed = [(cust_ssn,) for cust_ssn in pd.unique(np.asarray(cust_ssns)).tolist()]
+        else:
+            changed = [(None,)]  # e.g. new customers with generated keys: rebuild the views
+        self.cursor.executemany("INSERT INTO ViewChangeLog (CustSsn) VALUES (%s)", changed)
+
+
+    @instrumented
     def optimize_data_types(self, db_name):
         """Optimize data types for storage efficiency."""
-        self.connect()
+        if self.backend.name != "mysql":
+            return  # ALTER ... MODIFY and ENUM are MySQL-specific
+        self.connect(db_name)
         try:
-            self.cursor.execute(f"USE {db_name}")
             data_type_queries = [
                 "ALTER TABLE Customer MODIFY Gender ENUM('M', 'F')",
                 "ALTER TABLE ChronicDiseaseHistory MODIFY HasChronicDisease BOOLEAN",
@@ -322,56 +608,248 @@ class InsuranceAPI:
             for query in data_type_queries:
                 self.cursor.execute(query)
                 # print(f"Data type optimized: {query.split()[2]}")
-        except mysql.connector.Error as err:
+        except self.Error as err:
             print(f"Error: {err}")
         finally:
             self.close_connection()
 
 
+    @instrumented
     def insert_dataframe(self, table_name, dataframe, db_name):
         """Insert data from a pandas DataFrame into a specified table."""
         self.connect(db_name)  # Ensure the correct database is selected
         try:
+            dataframe = self._drop_null_columns(dataframe)
             # Prepare the insert query dynamically
             columns = ", ".join(dataframe.columns)
             placeholders = ", ".join(["%s"] * len(dataframe.columns))
             query = f"INSERT INTO {table_name} ({columns}) VALUES ({placeholders})"
 
             # Execute the query
-            self.cursor.executemany(query, dataframe.values.tolist())
-            self.connection.commit()
+            with self._undetermined_pool_guard(table_name):
+                self.cursor.executemany(query, dataframe.values.tolist())
+                self._log_changes(table_name, dataframe.get("CustSsn"))
+                self._maintain_undetermined_pool(table_name, dataframe.get("CustSsn"))
+                self.connection.commit()
+            self._update_feature_store(table_name, dataframe, db_name)
             # print(f"Inserted {self.cursor.rowcount} records into {table_name}.")
-        except mysql.connector.Error as err:
+        except self.Error as err:
             print(f"Error: {err}")
         finally:
             self.close_connection()
+            self._invalidate_caches(table_name, dataframe, db_name)
                
 
-    def fetch_health_metrics_with_disease_status(self, db_name):
+    @instrumented
+    def bulk_insert_dataframe(self, table_name, dataframe, db_name, chunk_size=1000, use_load_data=False):
+        """
+        Bulk-load a DataFrame into a table and report the load rate.
+        Args:
+            table_name (str): Target table.
+            dataframe (DataFrame): Rows to insert; column names must match the table.
+            db_name (str): Database name.
+            chunk_size (int): Rows per multi-row INSERT statement; each chunk is committed on its own.
+            use_load_data (bool): Write the frame to a temporary CSV and send it with LOAD DATA LOCAL INFILE
+                                  (MySQL only, requires allow_local_infile=True; other backends use INSERTs).
+        Returns:
+            dict: Table name, rows loaded, seconds and rows per second. After an error, rows counts the
+                  chunks committed before it; those stay loaded and the derived state includes them.
+        """
+        start = time.perf_counter()
+        rows_loaded = 0
+        self.connect(db_name)
+        try:
+            if use_load_data and self.backend.supports_load_data:
+                chunks = self._load_data_infile(table_name, dataframe)
+            else:
+                chunks = self._insert_chunks(table_name, dataframe, chunk_size)
+            while True:
+                with self._undetermined_pool_guard(table_name):
+                    chunk = next(chunks, None)  # Runs the chunk's INSERT
+                    if chunk is None:
+                        break
+                    # The pool and the view change log are committed with the chunk they describe
+                    self._log_changes(table_name, chunk.get("CustSsn"))
+                    self._maintain_undetermined_pool(table_name, chunk.get("CustSsn"))
+                    self.connection.commit()
+                rows_loaded += len(chunk)
+                self._update_feature_store(table_name, chunk, db_name)
+        except self.Error as err:
+            self.connection.rollback()
+            print(f"Error bulk loading {table_name}: {err}")
+        finally:
+            self.close_connection()
+            self._invalidate_caches(table_name, dataframe, db_name)
+
+        elapsed = time.perf_counter() - start
+        return {
+            "table": table_name,
+            "rows": rows_loaded,
+            "seconds": elapsed,
+            "rows_per_second": rows_loaded / elapsed if elapsed else 0.0
+        }
+
+    def _invalidate_caches(self, table_name, dataframe, db_name):
+        """Drop in-memory state derived from table_name after rows were written to it."""
+        if table_name == "Product":
+            self._invalidate_product_catalog(db_name)
+        elif table_name in ("ChronicDiseaseRisk", "Customer"):
+            self._invalidate_recommendations(db_name, dataframe)
+        if table_name in ("Customer", "HealthMetrics") and "CustSsn" in dataframe:
+            self._invalidate_customer_profiles(db_name, self._written_cust_ssns(dataframe))
+
+    def _invalidate_recommendations(self, db_name, data):
+        """Drop the cached recommendations of the customers in data."""
+        if self.recommendation_cache is not None and "CustSsn" in data:
+            self.recommendation_cache.invalidate(db_name, self._written_cust_ssns(data))
+
+    def _written_cust_ssns(self, data):
+        """CustSsn values of written rows, leaving out the nulls of new customers whose key the database generates."""
+        return data["CustSsn"].dropna().astype(int).unique().tolist()
+
+    @instrumented
+    def attach_feature_store(self, feature_store, db_name, rebuild=True):
+        """
+        Keep a featureStoreAPI.FeatureStore in step with the writes made through this object.
+        Args:
+            feature_store (FeatureStore): The store to maintain.
+            db_name (str): Database whose customers it holds.
+            rebuild (bool): Fill the store from fetch_training_data and fetch_unlabeled_data first.
+        """
+        if rebuild:
+            feature_store.build(self.fetch_training_data(db_name), self.fetch_unlabeled_data(db_name))
+        self.feature_stores[db_name] = feature_store
+
+    def _update_feature_store(self, table_name, dataframe, db_name):
+        """Apply committed HealthMetrics and ChronicDiseaseHistory rows to the attached feature store."""
+        feature_store = self.feature_stores.get(db_name)
+        if feature_store is None or "CustSsn" not in dataframe:
+            return
+        if table_name == "HealthMetrics" and set(feature_store.feature_columns) <= set(dataframe.columns):
+            feature_store.upsert(dataframe)
+        elif table_name == "ChronicDiseaseHistory" and "HasChronicDisease" in dataframe:
+            labeled = dataframe[dataframe["HasChronicDisease"].isin([0, 1])]
+            feature_store.set_labels(labeled["CustSsn"].to_numpy().tolist(),
+                                     labeled["HasChronicDisease"].astype(int).to_numpy().tolist())
+
+    def _stage_cust_ssns(self, table_name, cust_ssns):
+        """
+        Load CustSsn values into a temporary table on the open connection, so a lookup for any number
+        of customers stays one join instead of a long IN list. Drop the table once it is no longer needed.
+        """
+        self.cursor.execute(f"""
+        CREATE TEMPORARY TABLE IF NOT EXISTS {table_name} (
+            CustSsn INT NOT NULL
+        )
+        """)
+        self.cursor.execute(f"DELETE FROM {table_name}")
+        self.cursor.executemany(
+            f"INSERT INTO {table_name} (CustSsn) VALUES (%s)", [(int(cust_ssn),) for cust_ssn in set(cust_ssns)]
+        )
+
+    def _drop_null_columns(self, dataframe):
+        """
+        Leave all-NULL columns (e.g. an auto-increment key passed as None) to their column default.
+        Embedded backends reject an explicit NULL for a generated key.
+        """
+        if dataframe.empty:
+            return dataframe
+        return dataframe.dropna(axis=1, how="all")
+
+    def _insert_chunks(self, table_name, dataframe, chunk_size):
+        """
+        Send the frame as multi-row INSERT statements of chunk_size rows on the current connection.
+        Yields the rows of dataframe each statement inserted, before they are committed.
+        """
+        values_frame = self._drop_null_columns(dataframe)
+        columns = ", ".join(values_frame.columns)
+        row_placeholder = "(" + ", ".join(["%s"] * len(values_frame.columns)) + ")"
+
+        # Convert the frame once; NaN/NaT become NULL
+        values = values_frame.to_numpy(dtype=object)
+        values[pd.isna(values)] = None
+
+        for chunk_start in range(0, len(values), chunk_size):
+            chunk = values[chunk_start:chunk_start + chunk_size]
+            query = f"INSERT INTO {table_name} ({columns}) VALUES " + ", ".join([row_placeholder] * len(chunk))
+            self.cursor.execute(query, chunk.ravel().tolist())
+            yield dataframe.iloc[chunk_start:chunk_start + chunk_size]
+
+    def _load_data_infile(self, table_name, dataframe):
+        """
+        Write the frame to a temporary CSV and load it with LOAD DATA LOCAL INFILE on the current connection.
+        Yields the whole frame as one chunk once the statement ran, before it is committed.
+        """
+        frame = dataframe.copy()
+        bool_columns = frame.select_dtypes(include="bool").columns
+        frame[bool_columns] = frame[bool_columns].astype(int)  # MySQL reads 'True'/'False' as 0
+
+        handle, path = tempfile.mkstemp(suffix=".csv")
+        os.close(handle)
+        try:
+            frame.to_csv(path, index=False, header=False, na_rep="NULL", lineterminator="\n")
+            query = f"""
+            LOAD DATA LOCAL INFILE %s INTO TABLE {table_name}
+            FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"' ESCAPED BY ''
+            LINES TERMINATED BY '\\n'
+            ({", ".join(frame.columns)})
+            """
+            self.cursor.execute(query, (path,))
+        finally:
+            os.remove(path)
+        yield dataframe
+
+    @instrumented
+    def bulk_load_tables(self, tables, db_name, max_workers=4, **load_options):
+        """
+        Bulk-load several independent tables in parallel, one writer thread per table.
+        Tables linked by foreign keys (e.g. Customer before HealthMetrics) must be loaded in separate calls.
+        Args:
+            tables (dict): Mapping of table name to DataFrame.
+            db_name (str): Database name.
+            max_workers (int): Number of concurrent writers.
+            load_options: Passed through to bulk_insert_dataframe (chunk_size, use_load_data).
+        Returns:
+            list: One bulk_insert_dataframe report per table.
+        """
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(self.bulk_insert_dataframe, table_name, dataframe, db_name, **load_options)
+                for table_name, dataframe in tables.items()
+            ]
+            return [future.result() for future in futures]
+
+
+    @instrumented
+    def fetch_health_metrics_with_disease_status(self, db_name, chunksize=None):
         """
         Fetch health metrics data with the HasChronicDisease status.
         - db_name: The name of the database.
+        - chunksize: When set, return a generator of DataFrames with at most chunksize rows each.
         Returns: A pandas DataFrame containing health metrics and HasChronicDisease.
         """
+        # Join HealthMetrics with ChronicDiseaseHistory
+        query = """
+        SELECT 
+            hm.CustSsn, hm.MetricDate, hm.Age, hm.Weight, hm.Height, 
+            hm.BMI, hm.SmokingHabit, hm.DrinkingHabit, hm.ExerciseLevel, 
+            hm.SleepQuality, hm.HeartRate, hm.BloodPressure,
+            hm.Mental, hm.Physical, hm.Happiness,  -- New features added
+            IFNULL(cd.HasChronicDisease, 0) AS HasChronicDisease
+        FROM HealthMetrics hm
+        LEFT JOIN ChronicDiseaseHistory cd
+        ON hm.CustSsn = cd.CustSsn
+        """
+        if chunksize:
+            return self._stream_dataframes(query, db_name, chunksize, "Error fetching health metrics with disease status",
+                                           "fetch_health_metrics_with_disease_status")
         self.connect(db_name)
         try:
-            # Join HealthMetrics with ChronicDiseaseHistory
-            query = """
-            SELECT 
-                hm.CustSsn, hm.MetricDate, hm.Age, hm.Weight, hm.Height, 
-                hm.BMI, hm.SmokingHabit, hm.DrinkingHabit, hm.ExerciseLevel, 
-                hm.SleepQuality, hm.HeartRate, hm.BloodPressure,
-                hm.Mental, hm.Physical, hm.Happiness,  -- New features added
-                IFNULL(cd.HasChronicDisease, 0) AS HasChronicDisease
-            FROM HealthMetrics hm
-            LEFT JOIN ChronicDiseaseHistory cd
-            ON hm.CustSsn = cd.CustSsn
-            """
             self.cursor.execute(query)
             result = self.cursor.fetchall()
             columns = [col[0] for col in self.cursor.description]
             return pd.DataFrame(result, columns=columns)
-        except mysql.connector.Error as err:
+        except self.Error as err:
             print(f"Error fetching health metrics with disease status: {err}")
             return pd.DataFrame()  # Return an empty DataFrame if an error occurs
         finally:
@@ -379,30 +857,39 @@ class InsuranceAPI:
 
 
 
-    def fetch_training_data(self, db_name):
+    TRAINING_DATA_QUERY = """
+    SELECT 
+        hm.CustSsn, hm.Age, hm.Weight, hm.Height, hm.BMI, 
+        hm.SmokingHabit, hm.DrinkingHabit, hm.ExerciseLevel, 
+        hm.SleepQuality, hm.HeartRate, hm.BloodPressure,
+        hm.Mental, hm.Physical, hm.Happiness,  -- New features added
+        cd.HasChronicDisease
+    FROM HealthMetrics hm
+    INNER JOIN ChronicDiseaseHistory cd
+    ON hm.CustSsn = cd.CustSsn
+    WHERE cd.HasChronicDisease IN (1, 0)
+    """
+
+    @instrumented
+    def fetch_training_data(self, db_name, chunksize=None):
         """
         Fetch training data by joining HealthMetrics and ChronicDiseaseHistory.
         Excludes undetermined entries (customers without entries in ChronicDiseaseHistory).
+        - chunksize: When set, return a generator of DataFrames with at most chunksize rows each.
         """
+        query = self.TRAINING_DATA_QUERY
+        if self.materialized_views:
+            self.refresh_materialized_views(db_name)
+            query = "SELECT * FROM TrainingFeatures"
+        if chunksize:
+            return self._stream_dataframes(query, db_name, chunksize, "Error fetching training data", "fetch_training_data")
         self.connect(db_name)
         try:
-            query = """
-            SELECT 
-                hm.CustSsn, hm.Age, hm.Weight, hm.Height, hm.BMI, 
-                hm.SmokingHabit, hm.DrinkingHabit, hm.ExerciseLevel, 
-                hm.SleepQuality, hm.HeartRate, hm.BloodPressure,
-                hm.Mental, hm.Physical, hm.Happiness,  -- New features added
-                cd.HasChronicDisease
-            FROM HealthMetrics hm
-            INNER JOIN ChronicDiseaseHistory cd
-            ON hm.CustSsn = cd.CustSsn
-            WHERE cd.HasChronicDisease IN (1, 0)
-            """
             self.cursor.execute(query)
             result = self.cursor.fetchall()
             columns = [col[0] for col in self.cursor.description]
             return pd.DataFrame(result, columns=columns)
-        except mysql.connector.Error as err:
+        except self.Error as err:
             print(f"Error fetching training data: {err}")
             return pd.DataFrame()
         finally:
@@ -410,29 +897,44 @@ class InsuranceAPI:
 
             
 
-    def fetch_unlabeled_data(self, db_name):
+    UNLABELED_DATA_QUERY = """
+    SELECT 
+        CustSsn, Age, BMI, Weight, Height, SmokingHabit, 
+        DrinkingHabit, ExerciseLevel, SleepQuality, HeartRate, BloodPressure,
+        Mental, Physical, Happiness  -- New features added
+    FROM HealthMetrics hm
+    WHERE NOT EXISTS (
+        SELECT 1
+        FROM ChronicDiseaseHistory cd
+        WHERE cd.CustSsn = hm.CustSsn
+    )
+    """
+
+    @instrumented
+    def fetch_unlabeled_data(self, db_name, chunksize=None):
         """
         Fetch data for prediction (unlabeled data).
+        - chunksize: When set, return a generator of DataFrames with at most chunksize rows each.
         """
-        self.connect(db_name)
-        try:
+        query = self.UNLABELED_DATA_QUERY
+        if self.materialized_views:
+            self.refresh_materialized_views(db_name)
             query = """
             SELECT 
                 CustSsn, Age, BMI, Weight, Height, SmokingHabit, 
                 DrinkingHabit, ExerciseLevel, SleepQuality, HeartRate, BloodPressure,
-                Mental, Physical, Happiness  -- New features added
-            FROM HealthMetrics hm
-            WHERE NOT EXISTS (
-                SELECT 1
-                FROM ChronicDiseaseHistory cd
-                WHERE cd.CustSsn = hm.CustSsn
-            )
+                Mental, Physical, Happiness
+            FROM UndeterminedCustomers
             """
+        if chunksize:
+            return self._stream_dataframes(query, db_name, chunksize, "Error", "fetch_unlabeled_data")
+        self.connect(db_name)
+        try:
             self.cursor.execute(query)
             result = self.cursor.fetchall()
             columns = [col[0] for col in self.cursor.description]
             return pd.DataFrame(result, columns=columns)
-        except mysql.connector.Error as err:
+        except self.Error as err:
             print(f"Error: {err}")
             return pd.DataFrame()
         finally:
@@ -440,148 +942,626 @@ class InsuranceAPI:
 
 
 
+    def _risk_rows(self, data):
+        """Build (CustSsn, AtRisk, RiskLevel, ConfidenceScore) tuples column-wise from a predictions frame."""
+        return list(zip(
+            data["CustSsn"].to_numpy().tolist(),
+            data["AtRisk"].to_numpy().tolist(),
+            data["RiskLevel"].to_numpy().tolist(),
+            data["ConfidenceScore"].to_numpy().tolist()
+        ))
+
+    @instrumented
     def insert_clustering_results(self, data, db_name):
-        """Insert prediction results into the database."""
+        """
+        Insert prediction results into the database.
+        ChronicDiseaseRisk keeps one current row per customer, so an existing prediction is replaced.
+        """
         self.connect(db_name)
         try:
             query = """
             INSERT INTO ChronicDiseaseRisk (CustSsn, PredictionDate, AtRisk, RiskLevel, ConfidenceScore)
             VALUES (%s, CURDATE(), %s, %s, %s)
-            """
-            insert_data = [
-                (row['CustSsn'], row['AtRisk'], row['RiskLevel'], row['ConfidenceScore'])
-                for _, row in data.iterrows()
-            ]
-            self.cursor.executemany(query, insert_data)
+            """ + self.backend.upsert_clause(
+                ["CustSsn"], ["PredictionDate", "AtRisk", "RiskLevel", "ConfidenceScore"]
+            )
+            risk_rows = self._risk_rows(data)
+            # executemany sends a plain INSERT as a single multi-row statement
+            self.cursor.executemany(query, risk_rows)
+            if self.risk_history:
+                self.cursor.executemany("""
+                INSERT INTO ChronicDiseaseRiskHistory (CustSsn, PredictionDate, AtRisk, RiskLevel, ConfidenceScore)
+                VALUES (%s, CURDATE(), %s, %s, %s)
+                """, risk_rows)
             self.connection.commit()
             # print(f"Inserted {self.cursor.rowcount} records into ChronicDiseaseRisk.")
-        except mysql.connector.Error as err:
+        except self.Error as err:
+            self.connection.rollback()
             print(f"Error: {err}")
         finally:
             self.close_connection()
+            self._invalidate_recommendations(db_name, data)
 
 
+    @instrumented
     def get_random_undetermined_client(self, db_name):
         """
         Helper function: Get a random client with undetermined chronic disease status.
         Returns the CustSsn of the random client. (adjust when necessary)
+        Samples one slot of UndeterminedPool, so the cost does not grow with the number of clients.
+        """
+        clients = self.sample_undetermined_clients(db_name, 1)
+        if not clients:
+            print("No undetermined clients available.")
+            return None
+        return clients[0]  # Return only the CustSsn
+
+    # UndeterminedPool lookups: sampled slots ({slots} is one placeholder per slot), a claimed slot, the last slot
+    UNDETERMINED_SAMPLE_QUERY = "SELECT CustSsn FROM UndeterminedPool WHERE Slot IN ({slots})"
+    UNDETERMINED_SLOT_QUERY = "SELECT CustSsn FROM UndeterminedPool WHERE Slot = %s"
+    UNDETERMINED_LAST_SLOT_QUERY = (
+        "SELECT Slot, CustSsn FROM UndeterminedPool WHERE Slot = (SELECT MAX(Slot) FROM UndeterminedPool)"
+    )
+
+    @instrumented
+    def sample_undetermined_clients(self, db_name, count=1):
+        """
+        Pick distinct random clients with undetermined chronic disease status without claiming them.
+        Args:
+            db_name (str): Database name.
+            count (int): Number of clients wanted.
+        Returns:
+            list: Up to count CustSsn values (fewer when the pool is smaller).
         """
         self.connect(db_name)
         try:
-            # Fetch undetermined clients
-            query_client = """
-            SELECT hm.CustSsn, c.CustFirstName, c.CustLastName
+            for _ in range(3):  # Retry when a concurrent claim shrank the pool under the sampled slots
+                self.cursor.execute("SELECT MAX(Slot) FROM UndeterminedPool")
+                pool_size = self.cursor.fetchall()[0][0] or 0
+                if pool_size == 0:
+                    return []
+                slots = random.sample(range(1, pool_size + 1), min(count, pool_size))
+                placeholders = ", ".join(["%s"] * len(slots))
+                self.cursor.execute(self.UNDETERMINED_SAMPLE_QUERY.format(slots=placeholders), slots)
+                clients = [row[0] for row in self.cursor.fetchall()]
+                if len(clients) == len(slots):
+                    break
+            return clients
+        except self.Error as err:
+            print(f"Error: {err}")
+            return []
+        finally:
+            self.close_connection()
+
+    @instrumented
+    def claim_undetermined_clients(self, db_name, count=1):
+        """
+        Take distinct random undetermined clients out of the pool so no other worker samples or claims them.
+        Args:
+            db_name (str): Database name.
+            count (int): Number of clients wanted.
+        Returns:
+            list: Up to count claimed CustSsn values; hand unfinished ones back with release_undetermined_clients.
+        """
+        self.connect(db_name)
+        try:
+            claimed = []
+            with self._undetermined_lock:
+                for _ in range(count):
+                    last = self._last_undetermined_slot()
+                    if last is None:
+                        break
+                    slot = random.randint(1, last[0])
+                    self.cursor.execute(self.UNDETERMINED_SLOT_QUERY + self.backend.lock_clause, (slot,))
+                    cust_ssn = self.cursor.fetchall()[0][0]
+                    self._remove_undetermined_slot(slot, last)
+                    claimed.append(cust_ssn)
+                self.connection.commit()
+            return claimed
+        except self.Error as err:
+            self.connection.rollback()
+            print(f"Error claiming undetermined clients: {err}")
+            return []
+        finally:
+            self.close_connection()
+
+    @instrumented
+    def release_undetermined_clients(self, cust_ssns, db_name):
+        """
+        Return claimed clients to the pool; clients that got a ChronicDiseaseHistory row meanwhile stay out.
+        Args:
+            cust_ssns (list): CustSsn values returned by claim_undetermined_clients.
+            db_name (str): Database name.
+        """
+        self.connect(db_name)
+        try:
+            with self._undetermined_lock:  # Held through the commit, as by the other pool writers
+                self._add_undetermined_clients(cust_ssns)
+                self.connection.commit()
+        except self.Error as err:
+            self.connection.rollback()
+            print(f"Error releasing undetermined clients: {err}")
+        finally:
+            self.close_connection()
+
+    @instrumented
+    def rebuild_undetermined_pool(self, db_name):
+        """Refill UndeterminedPool from HealthMetrics and ChronicDiseaseHistory (for databases loaded behind InsuranceAPI's back)."""
+        self.connect(db_name)
+        try:
+            with self._undetermined_lock:
+                self.cursor.execute("DELETE FROM UndeterminedPool")
+                self._fill_undetermined_pool("")
+                self.connection.commit()
+        except self.Error as err:
+            self.connection.rollback()
+            print(f"Error rebuilding undetermined pool: {err}")
+        finally:
+            self.close_connection()
+
+    def _undetermined_pool_guard(self, table_name):
+        """The pool lock for writes to the tables UndeterminedPool is derived from, a no-op context otherwise."""
+        if table_name in ("HealthMetrics", "ChronicDiseaseHistory"):
+            return self._undetermined_lock
+        return contextlib.nullcontext()
+
+    def _maintain_undetermined_pool(self, table_name, cust_ssns):
+        """Keep UndeterminedPool in step with rows just written to HealthMetrics or ChronicDiseaseHistory."""
+        if cust_ssns is None:
+            return
+        if table_name == "HealthMetrics":
+            self._add_undetermined_clients(cust_ssns)
+        elif table_name == "ChronicDiseaseHistory":
+            self._remove_undetermined_clients(cust_ssns)
+
+    def _add_undetermined_clients(self, cust_ssns):
+        """Append the given customers to the pool if they are undetermined and not in it yet."""
+        cust_ssns = sorted(set(int(cust_ssn) for cust_ssn in cust_ssns))
+        if not cust_ssns:
+            return
+        with self._undetermined_lock:
+            self._stage_cust_ssns("UndeterminedCandidates", cust_ssns)
+            self._fill_undetermined_pool("AND hm.CustSsn IN (SELECT CustSsn FROM UndeterminedCandidates)")
+            self.cursor.execute("DROP TABLE UndeterminedCandidates")
+
+    def _remove_undetermined_clients(self, cust_ssns):
+        """
+        Take the given customers out of the pool with a fixed number of statements, however many there are:
+        their slots are deleted and the customers of the highest slots are moved into the holes left below
+        the new pool size, keeping the slots dense.
+        """
+        cust_ssns = sorted(set(int(cust_ssn) for cust_ssn in cust_ssns))
+        if not cust_ssns:
+            return
+        with self._undetermined_lock:
+            last = self._last_undetermined_slot()
+            if last is None:
+                return
+            self._stage_cust_ssns("UndeterminedRemovals", cust_ssns)
+            self.cursor.execute(
+                "SELECT p.Slot FROM UndeterminedPool p JOIN UndeterminedRemovals r ON p.CustSsn = r.CustSsn"
+                + self.backend.lock_clause
+            )
+            removed_slots = [row[0] for row in self.cursor.fetchall()]
+            if removed_slots:
+                self.cursor.execute(
+                    "DELETE FROM UndeterminedPool WHERE CustSsn IN (SELECT CustSsn FROM UndeterminedRemovals)"
+                )
+                pool_size = last[0] - len(removed_slots)
+                holes = sorted(slot for slot in removed_slots if slot <= pool_size)
+                self.cursor.execute(
+                    "SELECT CustSsn FROM UndeterminedPool WHERE Slot > %s ORDER BY Slot" + self.backend.lock_clause,
+                    (pool_size,)
+                )
+                moved = [row[0] for row in self.cursor.fetchall()]  # As many as there are holes
+                self.cursor.execute("DELETE FROM UndeterminedPool WHERE Slot > %s", (pool_size,))
+                if holes:
+                    self.cursor.executemany(
+                        "INSERT INTO UndeterminedPool (Slot, CustSsn) VALUES (%s, %s)", list(zip(holes, moved))
+                    )
+            self.cursor.execute("DROP TABLE UndeterminedRemovals")
+
+    def _fill_undetermined_pool(self, condition):
+        """Append undetermined customers matching condition after the current last slot."""
+        last = self._last_undetermined_slot()
+        self.cursor.execute(f"""
+        INSERT INTO UndeterminedPool (Slot, CustSsn)
+        SELECT %s + ROW_NUMBER() OVER (ORDER BY u.CustSsn), u.CustSsn
+        FROM (
+            SELECT DISTINCT hm.CustSsn
             FROM HealthMetrics hm
-            LEFT JOIN ChronicDiseaseHistory cd ON hm.CustSsn = cd.CustSsn
             JOIN Customer c ON hm.CustSsn = c.CustSsn
-            WHERE cd.CustSsn IS NULL
-            """
-            self.cursor.execute(query_client)
-            clients = self.cursor.fetchall()
-    
-            if not clients:
-                print("No undetermined clients available.")
-                return None
-    
-            # Choose a random client
-            random_client = random.choice(clients)
-            cust_ssn, first_name, last_name = random_client
-            
-            return cust_ssn  # Return only the CustSsn
-        
-        except mysql.connector.Error as err:
-            print(f"Error: {err}")
+            WHERE NOT EXISTS (SELECT 1 FROM ChronicDiseaseHistory cd WHERE cd.CustSsn = hm.CustSsn)
+            AND NOT EXISTS (SELECT 1 FROM UndeterminedPool p WHERE p.CustSsn = hm.CustSsn)
+            {condition}
+        ) u
+        """, (last[0] if last else 0,))
+
+    def _last_undetermined_slot(self):
+        """(Slot, CustSsn) of the highest pool slot, locked for this transaction, or None when the pool is empty."""
+        self.cursor.execute(self.UNDETERMINED_LAST_SLOT_QUERY + self.backend.lock_clause)
+        rows = self.cursor.fetchall()
+        return rows[0] if rows else None
+
+    def _remove_undetermined_slot(self, slot, last):
+        """Delete a slot by moving the last slot's customer into it, keeping the slots dense."""
+        last_slot, last_cust_ssn = last
+        self.cursor.execute("DELETE FROM UndeterminedPool WHERE Slot = %s", (last_slot,))
+        if slot != last_slot:
+            self.cursor.execute("UPDATE UndeterminedPool SET CustSsn = %s WHERE Slot = %s", (last_cust_ssn, slot))
+
+
+    # Customer row plus the customer's latest HealthMetrics row (highest MetricID)
+    PROFILE_QUERY = """
+    SELECT
+        c.CustSsn, c.CustFirstName, c.CustLastName, c.CustDOB, c.Gender,
+        hm.MetricDate, hm.Age, hm.Weight, hm.Height, hm.BMI,
+        hm.SmokingHabit, hm.DrinkingHabit, hm.ExerciseLevel,
+        hm.SleepQuality, hm.HeartRate, hm.BloodPressure,
+        hm.Mental, hm.Physical, hm.Happiness
+    FROM Customer c
+    LEFT JOIN HealthMetrics hm ON hm.MetricID = (
+        SELECT MAX(h2.MetricID) FROM HealthMetrics h2 WHERE h2.CustSsn = c.CustSsn
+    )
+    """
+    CUSTOMER_PROFILE_QUERY = PROFILE_QUERY + "WHERE c.CustSsn = %s"
+
+    @instrumented
+    def get_customer_profile(self, client_ssn, db_name):
+        """
+        Return the cached profile of a customer, loading it on a miss.
+        Args:
+            client_ssn (int): Customer SSN.
+            db_name (str): Database name.
+        Returns:
+            dict: Name, DOB, gender and latest health metrics keyed by column name (treat as read-only),
+                  or None when the customer does not exist.
+        """
+        profile = self._profiles.get(db_name, {}).get(int(client_ssn))
+        if profile is not None:
+            return profile
+        self.connect(db_name)
+        try:
+            return self._customer_profile(client_ssn, db_name)
+        except self.Error as err:
+            print(f"Error fetching customer profile: {err}")
             return None
         finally:
             self.close_connection()
 
+    @instrumented
+    def warm_customer_profiles(self, db_name, client_ssns=None):
+        """
+        Load many customer profiles into the cache with one query.
+        Args:
+            db_name (str): Database name.
+            client_ssns (list): Customers to load, or None for every customer.
+        Returns:
+            int: Number of profiles loaded.
+        """
+        query = self.PROFILE_QUERY
+        self.connect(db_name)
+        try:
+            with self._profile_lock:
+                generation = self._profile_generation
+            if client_ssns is not None:
+                self._stage_cust_ssns("ProfileRequest", client_ssns)
+                query += "JOIN ProfileRequest q ON q.CustSsn = c.CustSsn"
+            self.cursor.execute(query)
+            columns = [col[0] for col in self.cursor.description]
+            profiles = {row[0]: dict(zip(columns, row)) for row in self.cursor.fetchall()}
+            if client_ssns is not None:
+                self.cursor.execute("DROP TABLE ProfileRequest")
+                self.connection.commit()
+        except self.Error as err:
+            self.connection.rollback()
+            print(f"Error warming customer profiles: {err}")
+            return 0
+        finally:
+            self.close_connection()
+
+        with self._profile_lock:
+            if self._profile_generation == generation:
+                self._profiles.setdefault(db_name, {}).update(profiles)
+        return len(profiles)
+
+    def _customer_profile(self, client_ssn, db_name):
+        """Cached profile of one customer; loads it on the calling thread's open connection on a miss."""
+        client_ssn = int(client_ssn)
+        profile = self._profiles.get(db_name, {}).get(client_ssn)
+        if profile is not None:
+            return profile
 
+        with self._profile_lock:
+            generation = self._profile_generation
+        cursor = self._execute(self.CUSTOMER_PROFILE_QUERY, (client_ssn,))
+        rows = cursor.fetchall()
+        if not rows:
+            return None
+        profile = dict(zip([col[0] for col in cursor.description], rows[0]))
+
+        with self._profile_lock:
+            if self._profile_generation == generation:
+                self._profiles.setdefault(db_name, {})[client_ssn] = profile
+        return profile
+
+    def _invalidate_customer_profiles(self, db_name, cust_ssns=None):
+        """Drop the cached profiles of the given customers, or of every customer of db_name when cust_ssns is None."""
+        with self._profile_lock:
+            self._profile_generation += 1
+            if cust_ssns is None:
+                self._profiles.pop(db_name, None)
+                return
+            profiles = self._profiles.get(db_name, {})
+            for cust_ssn in cust_ssns:
+                profiles.pop(int(cust_ssn), None)
+
+
+    @instrumented
+    def load_product_catalog(self, db_name):
+        """
+        Load the Product table into the in-memory catalog used by recommend_products.
+        Call at startup to keep the first recommendation off the database; otherwise it loads on first use.
+        """
+        self.connect(db_name)
+        try:
+            self._product_catalog(db_name)
+        except self.Error as err:
+            print(f"Error loading product catalog: {err}")
+        finally:
+            self.close_connection()
+
+    def _product_catalog(self, db_name):
+        """
+        Return the catalog for db_name: one (SeriesName, PlanName) per risk tier 0-5, None where no
+        product exists. Loads on the calling thread's open connection when not cached.
+        """
+        catalog = self._product_catalogs.get(db_name)
+        if catalog is not None:
+            return catalog
+
+        with self._catalog_lock:
+            version = self._catalog_versions.get(db_name, 0)
+        self.cursor.execute("""
+        SELECT RiskLevel, SeriesName, PlanName
+        FROM Product
+        ORDER BY LineOfBusiness DESC
+        """)
+        catalog = [None] * 6
+        for risk_level, series_name, plan_name in self.cursor.fetchall():
+            if risk_level is not None and 0 <= risk_level <= 5:
+                catalog[risk_level] = (series_name, plan_name)  # Lowest LineOfBusiness per tier wins
+
+        with self._catalog_lock:
+            if self._catalog_versions.get(db_name, 0) == version:
+                self._product_catalogs[db_name] = catalog
+        return catalog
+
+    def _invalidate_product_catalog(self, db_name):
+        """Drop the cached catalog, and the recommendations built from it, after the Product table changed."""
+        with self._catalog_lock:
+            self._catalog_versions[db_name] = self._catalog_versions.get(db_name, 0) + 1
+            self._product_catalogs.pop(db_name, None)
+        if self.recommendation_cache is not None:
+            self.recommendation_cache.clear(db_name)
+
+
+    def _risk_tier_case(self, column):
+        """
+        SQL CASE mapping a risk level column (0-100) to the same tier as risk_level // (100/6).
+        FLOOR(column / (100/6)) disagrees with Python's floor division at 50 and 100, and RiskLevel may hold
+        non-integral values (SQLite keeps REAL values in the INT column), so each boundary is the smallest
+        double whose floor division reaches the tier, emitted as a double literal.
+        """
+        step = 100/6
+        conditions = []
+        for tier in range(6, 0, -1):
+            lowest = tier * step
+            while math.nextafter(lowest, -math.inf) // step >= tier:
+                lowest = math.nextafter(lowest, -math.inf)
+            while lowest // step < tier:
+                lowest = math.nextafter(lowest, math.inf)
+            conditions.append(f"WHEN {column} >= {lowest!r}E0 THEN {tier}")
+        return f"CASE {' '.join(conditions)} ELSE 0 END"
+
+    # Risk tier, customer name and product of one client ({risk_tier} is filled with _risk_tier_case)
+    SINGLE_RECOMMENDATION_QUERY = """
+    SELECT r.RiskTier, c.CustFirstName, c.CustLastName, p.SeriesName, p.PlanName
+    FROM (
+        SELECT CustSsn, {risk_tier} AS RiskTier
+        FROM ChronicDiseaseRisk
+        WHERE CustSsn = %s
+    ) r
+    LEFT JOIN Customer c ON c.CustSsn = r.CustSsn
+    LEFT JOIN Product p ON p.LineOfBusiness = (
+        SELECT MIN(p2.LineOfBusiness) FROM Product p2 WHERE p2.RiskLevel = r.RiskTier
+    )
+    """
+
+    def _recommend_products_single_query(self, client_ssn):
+        """recommend_products with the risk, product and customer lookups in one query on the open connection."""
+        if self._single_recommendation_query is None:
+            self._single_recommendation_query = self.SINGLE_RECOMMENDATION_QUERY.format(
+                risk_tier=self._risk_tier_case("RiskLevel")
+            )
+        result = self._execute(self._single_recommendation_query, (client_ssn,)).fetchall()
+
+        if not result:
+            print(f"No risk level found for client {client_ssn}.")
+            return None
+
+        mapped_risk_level, first_name, last_name, series_name, plan_name = result[0]
+
+        if series_name is None:
+            print(f"No products available for mapped risk level {float(mapped_risk_level)}.")
+            return None
+
+        if first_name is None:
+            print(f"No customer found with SSN {client_ssn}.")
+            return None
+
+        full_name = f"{first_name} {last_name}"
+        recommendation_message = f"\nHi {full_name}. Thanks for your patience! The recommendation for you is the product '{series_name}' under the plan '{plan_name}'."
+
+        print(recommendation_message)
+        return recommendation_message
+
+
+    RISK_LEVEL_QUERY = """
+    SELECT RiskLevel
+    FROM ChronicDiseaseRisk
+    WHERE CustSsn = %s
+    """
+
+    @instrumented
     def recommend_products(self, client_ssn, db_name):
         """
         Recommend a product for the given client based on their risk level.
         - client_ssn: The SSN of the client.
         """
+        if self.recommendation_cache is not None:
+            recommendation_message, token = self.recommendation_cache.get(db_name, client_ssn)
+            if recommendation_message is not None:
+                print(recommendation_message)
+                return recommendation_message
+            recommendation_message = self._recommend_products(client_ssn, db_name)
+            if recommendation_message is not None:
+                self.recommendation_cache.put(db_name, client_ssn, recommendation_message, token)
+            return recommendation_message
+        return self._recommend_products(client_ssn, db_name)
+
+    def _recommend_products(self, client_ssn, db_name):
+        """recommend_products without the result cache."""
         self.connect(db_name)
         try:
+            if self.single_query_recommendations:
+                return self._recommend_products_single_query(client_ssn)
+
             # Fetch the risk level for the client
-            query_risk = f"""
-            SELECT RiskLevel
-            FROM ChronicDiseaseRisk
-            WHERE CustSsn = {client_ssn}
-            """
-            self.cursor.execute(query_risk)
-            risk_level_data = self.cursor.fetchone()
+            risk_level_data = self._execute(self.RISK_LEVEL_QUERY, (client_ssn,)).fetchall()
     
             if not risk_level_data:
                 print(f"No risk level found for client {client_ssn}.")
                 return None
     
-            risk_level = risk_level_data[0]
+            risk_level = risk_level_data[0][0]
     
             # Map risk level (0-100) to 0-5
             mapped_risk_level = risk_level // (100/6)  
     
-            # Fetch product based on mapped risk level
-            query_product = f"""
-            SELECT SeriesName, PlanName
-            FROM Product
-            WHERE RiskLevel = {mapped_risk_level}
-            LIMIT 1
-            """
-            self.cursor.execute(query_product)
-            product = self.cursor.fetchone()
+            # Look up the product for the mapped risk level in the in-memory catalog
+            catalog = self._product_catalog(db_name)
+            product = catalog[int(mapped_risk_level)] if 0 <= mapped_risk_level < len(catalog) else None
     
             if not product:
                 print(f"No products available for mapped risk level {mapped_risk_level}.")
                 return None
     
-            # Fetch the customer's name
-            query_customer = f"""
-            SELECT CustFirstName, CustLastName
-            FROM Customer
-            WHERE CustSsn = {client_ssn}
-            """
-            self.cursor.execute(query_customer)
-            customer_name = self.cursor.fetchone()
+            # Fetch the customer's name from the profile cache
+            profile = self._customer_profile(client_ssn, db_name)
     
-            if not customer_name:
+            if not profile:
                 print(f"No customer found with SSN {client_ssn}.")
                 return None
     
             # Format the output
-            full_name = f"{customer_name[0]} {customer_name[1]}"
+            full_name = f"{profile['CustFirstName']} {profile['CustLastName']}"
             series_name, plan_name = product
             recommendation_message = f"\nHi {full_name}. Thanks for your patience! The recommendation for you is the product '{series_name}' under the plan '{plan_name}'."
     
             print(recommendation_message)
             return recommendation_message
-        except mysql.connector.Error as err:
+        except self.Error as err:
             print(f"Error: {err}")
             return None
         finally:
             self.close_connection()
             
     
-    def run_custom_query(self, query, db_name):
+    @instrumented
+    def recommend_products_batch(self, client_ssns, db_name):
+        """
+        Recommend products for many clients with set-based queries instead of one call per client.
+        Args:
+            client_ssns (list): SSNs of the clients, or None for every client with a risk level.
+            db_name (str): Database name.
+        Returns:
+            pd.DataFrame: One row per client that has a risk level and a Customer row, with CustSsn,
+                          CustFirstName, CustLastName, RiskLevel, RiskTier, SeriesName, PlanName and
+                          Message (SeriesName, PlanName and Message are None when the tier has no product).
+        """
+        query = """
+        SELECT r.CustSsn, c.CustFirstName, c.CustLastName, r.RiskLevel
+        FROM ChronicDiseaseRisk r
+        JOIN Customer c ON c.CustSsn = r.CustSsn
+        """
+        self.connect(db_name)
+        try:
+            if client_ssns is not None:
+                self._stage_cust_ssns("RecommendationRequest", client_ssns)
+                query += "JOIN RecommendationRequest q ON q.CustSsn = r.CustSsn"
+            self.cursor.execute(query)
+            result = self.cursor.fetchall()
+            columns = [col[0] for col in self.cursor.description]
+            catalog = self._product_catalog(db_name)
+            if client_ssns is not None:
+                self.cursor.execute("DROP TABLE RecommendationRequest")
+                self.connection.commit()
+        except self.Error as err:
+            self.connection.rollback()
+            print(f"Error: {err}")
+            return pd.DataFrame()
+        finally:
+            self.close_connection()
+
+        recommendations = pd.DataFrame(result, columns=columns)
+        risk_levels = recommendations["RiskLevel"].to_numpy(dtype=float)
+
+        # Map risk level (0-100) to 0-5; tiers without a catalog entry point at the trailing None slot
+        tiers = np.floor_divide(risk_levels, 100/6)
+        slots = np.where((tiers >= 0) & (tiers < len(catalog)), np.nan_to_num(tiers), len(catalog)).astype(int)
+        series_names = np.array([product[0] if product else None for product in catalog] + [None], dtype=object)
+        plan_names = np.array([product[1] if product else None for product in catalog] + [None], dtype=object)
+
+        # Object columns keep None for missing products (pandas would infer a string dtype that holds NaN)
+        recommendations["RiskTier"] = tiers
+        recommendations["SeriesName"] = pd.Series(series_names[slots], index=recommendations.index, dtype=object)
+        recommendations["PlanName"] = pd.Series(plan_names[slots], index=recommendations.index, dtype=object)
+        messages = (
+            "\nHi " + recommendations["CustFirstName"].astype(str) + " " + recommendations["CustLastName"].astype(str)
+            + ". Thanks for your patience! The recommendation for you is the product '"
+            + recommendations["SeriesName"].astype(str) + "' under the plan '"
+            + recommendations["PlanName"].astype(str) + "'."
+        )
+        recommendations["Message"] = messages.astype(object).where(recommendations["SeriesName"].notna(), None)
+        return recommendations
+
+
+    @instrumented
+    def run_custom_query(self, query, db_name, params=None):
         """
         Execute a custom query and return the results.
         Args:
             query (str): The SQL query to execute.
             db_name (str): The name of the database.
+            params (tuple): Values bound to the %s placeholders; parameterized queries are prepared and cached.
         Returns:
             list: The fetched results of the query.
         """
         self.connect(db_name)
         try:
+            if params is not None:
+                return self._execute(query, params).fetchall()
             self.cursor.execute(query)
             results = self.cursor.fetchall()
             return results
-        except mysql.connector.Error as err:
+        except self.Error as err:
             print(f"Error executing custom query: {err}")
             return []
         finally:
             self.close_connection()
     
+    @instrumented
     def update_health_metrics(self, cust_ssn, mental, physical, happiness, db_name):
         """
         Update the health metrics (mental, physical, happiness) for a specific customer.
@@ -594,53 +1574,89 @@ class InsuranceAPI:
         """
         self.connect(db_name)
         try:
-            query = f"""
+            query = """
                 UPDATE HealthMetrics
                 SET Mental = %s,
                     Physical = %s,
                     Happiness = %s
                 WHERE CustSsn = %s
             """
-            self.cursor.execute(query, (mental, physical, happiness, cust_ssn))
+            self._execute(query, (mental, physical, happiness, cust_ssn))
+            self._log_changes("HealthMetrics", [cust_ssn])
             self.connection.commit()
+            if db_name in self.feature_stores:
+                self.feature_stores[db_name].update(
+                    cust_ssn, {"Mental": mental, "Physical": physical, "Happiness": happiness}
+                )
             # print(f"Health metrics updated for customer {cust_ssn}.")
-        except mysql.connector.Error as err:
+        except self.Error as err:
             print(f"Error updating health metrics: {err}")
         finally:
             self.close_connection()
+            self._invalidate_customer_profiles(db_name, [cust_ssn])
             
             
+    @instrumented
     def update_clustering_results(self, data, db_name):
         """
         Update prediction results in the database.
+        The predictions are bulk-inserted into a temporary staging table and applied to the
+        customers that already have a row with one set-based upsert, instead of one UPDATE per row.
         Args:
             data (DataFrame): DataFrame containing the predictions with CustSsn as the key.
             db_name (str): Database name.
         """
         self.connect(db_name)
         try:
-            query = """
-            UPDATE ChronicDiseaseRisk
-            SET 
-                PredictionDate = CURDATE(),
-                AtRisk = %s,
-                RiskLevel = %s,
-                ConfidenceScore = %s
-            WHERE CustSsn = %s
-            """
-            update_data = [
-                (row['AtRisk'], row['RiskLevel'], row['ConfidenceScore'], row['CustSsn'])
-                for _, row in data.iterrows()
-            ]
-            self.cursor.executemany(query, update_data)
+            self.cursor.execute("""
+            CREATE TEMPORARY TABLE IF NOT EXISTS ChronicDiseaseRiskStaging (
+                CustSsn INT NOT NULL,
+                AtRisk BOOLEAN,
+                RiskLevel INT,
+                ConfidenceScore FLOAT
+            )
+            """)
+            self.cursor.execute("DELETE FROM ChronicDiseaseRiskStaging")
+            self.cursor.executemany("""
+            INSERT INTO ChronicDiseaseRiskStaging (CustSsn, AtRisk, RiskLevel, ConfidenceScore)
+            VALUES (%s, %s, %s, %s)
+            """, self._risk_rows(data))
+            self.cursor.execute("""
+            INSERT INTO ChronicDiseaseRisk (CustSsn, PredictionDate, AtRisk, RiskLevel, ConfidenceScore)
+            SELECT s.CustSsn, CURDATE(), s.AtRisk, s.RiskLevel, s.ConfidenceScore
+            FROM ChronicDiseaseRiskStaging s
+            WHERE EXISTS (SELECT 1 FROM ChronicDiseaseRisk r WHERE r.CustSsn = s.CustSsn)
+            """ + self.backend.upsert_clause(
+                ["CustSsn"], ["PredictionDate", "AtRisk", "RiskLevel", "ConfidenceScore"]
+            ))
+            if self.risk_history:
+                self.cursor.execute("""
+                INSERT INTO ChronicDiseaseRiskHistory (CustSsn, PredictionDate, AtRisk, RiskLevel, ConfidenceScore)
+                SELECT s.CustSsn, CURDATE(), s.AtRisk, s.RiskLevel, s.ConfidenceScore
+                FROM ChronicDiseaseRiskStaging s
+                JOIN ChronicDiseaseRisk r ON r.CustSsn = s.CustSsn
+                """)
             self.connection.commit()
             # print(f"Updated {self.cursor.rowcount} records in ChronicDiseaseRisk.")
-        except mysql.connector.Error as err:
+            self.cursor.execute("DROP TABLE ChronicDiseaseRiskStaging")
+        except self.Error as err:
+            self.connection.rollback()
             print(f"Error updating clustering results: {err}")
         finally:
             self.close_connection()
+            self._invalidate_recommendations(db_name, data)
             
     
+    USER_METRICS_QUERY = """
+    SELECT 
+        CustSsn, Age, BMI, Weight, Height, SmokingHabit, 
+        DrinkingHabit, ExerciseLevel, SleepQuality, HeartRate, BloodPressure,
+        Mental, Physical, Happiness
+    FROM HealthMetrics
+    WHERE CustSsn = %s
+    """
+
+    @instrumented
     def fetch_unlabeled_data_for_user(self, db_name, cust_ssn):
         """
         Fetch data for prediction for a specific user.
@@ -652,19 +1668,11 @@ class InsuranceAPI:
         """
         self.connect(db_name)
         try:
-            query = f"""
-            SELECT 
-                CustSsn, Age, BMI, Weight, Height, SmokingHabit, 
-                DrinkingHabit, ExerciseLevel, SleepQuality, HeartRate, BloodPressure,
-                Mental, Physical, Happiness
-            FROM HealthMetrics
-            WHERE CustSsn = {cust_ssn}
-            """
-            self.cursor.execute(query)
-            result = self.cursor.fetchall()
-            columns = [col[0] for col in self.cursor.description]
+            cursor = self._execute(self.USER_METRICS_QUERY, (cust_ssn,))
+            result = cursor.fetchall()
+            columns = [col[0] for col in cursor.description]
             return pd.DataFrame(result, columns=columns)
-        except mysql.connector.Error as err:
+        except self.Error as err:
             print(f"Error fetching data for user {cust_ssn}: {err}")
             return pd.DataFrame()
         finally:
@@ -673,8 +1681,10 @@ class InsuranceAPI:
 
         
     def close_connection(self):
-        """Close the database connection."""
+        """Close the cursor and hand the connection back to the backend (pooled connections are reused)."""
         if self.cursor:
             self.cursor.close()
         if self.connection:
-            self.connection.close()
+            self.backend.release(self.connection)
+        self.cursor = None
+        self.connection = None
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Xueyao Zhao
+"""
+
+import functools
+import logging
+import threading
+import time
+from collections import deque
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+class CallRecord:
+    """Timings and volumes collected for one call of an instrumented method."""
+
+    def __init__(self, name):
+        self.name = name
+        self.start = time.perf_counter()
+        self.wall = 0.0
+        self.connect = 0.0
+        self.execute = 0.0
+        self.fetch = 0.0
+        self.queries = 0
+        self.rows = 0
+        self.bytes = 0
+        self.errors = 0
+
+
+class MetricsRegistry:
+    """In-process registry of per-method call statistics and slow queries."""
+
+    FIELDS = ["wall", "connect", "execute", "fetch", "queries", "rows", "bytes", "errors"]
+
+    def __init__(self, slow_query_ms=500, slow_log_size=100):
+        """
+        Args:
+            slow_query_ms (float): Queries whose execute time exceeds this are logged with their parameters
+                                   (None disables the slow-query log).
+            slow_log_size (int): Number of recent slow queries kept in slow_queries.
+        """
+        self.slow_query_ms = slow_query_ms
+        self.slow_queries = deque(maxlen=slow_log_size)
+        self._lock = threading.Lock()
+        self._totals = {}  # method name -> {"calls": n, "max_wall": s, field: sum}
+        self._local = threading.local()
+
+    def _stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def current(self):
+        """The innermost call being recorded on this thread, or None."""
+        stack = self._stack()
+        return stack[-1] if stack else None
+
+    def begin(self, name, track=True):
+        """Start recording a call; with track=True it becomes the thread's current call."""
+        record = CallRecord(name)
+        if track:
+            self._stack().append(record)
+        return record
+
+    def end(self, record, track=True):
+        """Finish a call and add it to the totals."""
+        record.wall = time.perf_counter() - record.start
+        if track:
+            self._stack().pop()
+        with self._lock:
+            totals = self._totals.setdefault(record.name, dict.fromkeys(["calls", "max_wall"] + self.FIELDS, 0))
+            totals["calls"] += 1
+            totals["max_wall"] = max(totals["max_wall"], record.wall)
+            for field in self.FIELDS:
+                totals[field] += getattr(record, field)
+
+    def observe_query(self, query, params, seconds):
+        """Log a statement to the slow-query log when it exceeded the threshold."""
+        if self.slow_query_ms is None or seconds * 1000 < self.slow_query_ms:
+            return
+        if isinstance(params, list) and len(params) > 3:
+            params = params[:3] + [f"... {len(params)} rows"]  # executemany batches
+        entry = {"ms": seconds * 1000, "sql": " ".join(str(query).split()), "params": params}
+        self.slow_queries.append(entry)
+        logger.warning("Slow query (%.1f ms): %s params=%r", entry["ms"], entry["sql"], params)
+
+    def summary(self):
+        """
+        Aggregate statistics per method.
+        Returns:
+            pd.DataFrame: Calls, errors, totals and means (seconds, rows, bytes) indexed by method name.
+        """
+        with self._lock:
+            totals = {name: dict(values) for name, values in self._totals.items()}
+        summary = pd.DataFrame.from_dict(totals, orient="index")
+        if summary.empty:
+            return summary
+        for field in ["wall", "connect", "execute", "fetch", "rows", "bytes"]:
+            summary[f"mean_{field}"] = summary[field] / summary["calls"]
+        return summary.sort_values("wall", ascending=False)
+
+    def reset(self):
+        """Drop all collected statistics."""
+        with self._lock:
+            self._totals.clear()
+            self.slow_queries.clear()
+
+
+# Registry shared by every InsuranceAPI in the process unless one is passed explicitly
+REGISTRY = MetricsRegistry()
+
+
+def instrumented(method):
+    """Record wall time and the connection, execute and fetch work of an InsuranceAPI method."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        record = self.metrics.begin(method.__name__)
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.metrics.end(record)
+    return wrapper
+
+
+def _approximate_bytes(rows):
+    """Estimate the size of fetched rows from the first row's values."""
+    if not rows:
+        return 0
+    row_bytes = 0
+    for value in rows[0]:
+        if isinstance(value, (str, bytes, bytearray)):
+            row_bytes += len(value)
+        elif value is not None:
+            row_bytes += 8
+    return row_bytes * len(rows)
+
+
+class InstrumentedCursor:
+    """Cursor wrapper that charges execute and fetch time, rows and bytes to a call record."""
+
+    def __init__(self, cursor, registry, record=None):
+        """
+        Args:
+            record (CallRecord): Record to charge; defaults to the thread's current call.
+        """
+        self._cursor = cursor
+        self._registry = registry
+        self._record = record
+
+    def _target(self):
+        return self._record or self._registry.current()
+
+    def _timed(self, method, query, params):
+        record = self._target()
+        start = time.perf_counter()
+        try:
+            if params is None:
+                result = method(query)
+            else:
+                result = method(query, params)
+        except Exception:
+            if record:
+                record.errors += 1
+            raise
+        elapsed = time.perf_counter() - start
+        if record:
+            record.execute += elapsed
+            record.queries += 1
+        self._registry.observe_query(query, params, elapsed)
+        return result
+
+    def execute(self, query, params=None):
+        return self._timed(self._cursor.execute, query, params)
+
+    def executemany(self, query, rows):
+        return self._timed(self._cursor.executemany, query, rows)
+
+    def _fetched(self, start, rows):
+        record = self._target()
+        if record:
+            record.fetch += time.perf_counter() - start
+            record.rows += len(rows)
+            record.bytes += _approximate_bytes(rows)
+        return rows
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = self._cursor.fetchone()
+        self._fetched(start, [row] if row is not None else [])
+        return row
+
+    def fetchmany(self, size):
+        start = time.perf_counter()
+        return self._fetched(start, self._cursor.fetchmany(size))
+
+    def fetchall(self):
+        start = time.perf_counter()
+        return self._fetched(start, self._cursor.fetchall())
+
+    def __getattr__(self, name):
+        # description, rowcount, close, ... come from the wrapped cursor
+        return getattr(self._cursor, name)
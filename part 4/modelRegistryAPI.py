@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Xueyao Zhao
+"""
+
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from MLAPI import MLAPI
+
+
+class ModelRegistry:
+    """
+    Versioned MLAPI artifacts under one directory, with one version marked active.
+    Layout: <root>/registry.json plus one save_model directory per version under <root>/versions/.
+    registry.json keeps the promoted versions as a stack, so each rollback returns to the one below.
+    Promoted versions that leave the stack (rolled back from, or below max_rollback) have their artifact deleted.
+    """
+
+    def __init__(self, root_dir, max_rollback=5):
+        """
+        Args:
+            root_dir (str): Registry directory; created if missing.
+            max_rollback (int): Promoted versions kept on the rollback stack, the active one included.
+        """
+        self.root_dir = root_dir
+        self.max_rollback = max_rollback
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(root_dir, "versions"), exist_ok=True)
+
+    def _read(self):
+        path = os.path.join(self.root_dir, "registry.json")
+        if not os.path.exists(path):
+            return {"active": None, "stack": [], "promotions": [], "versions": {}}
+        with open(path) as f:
+            return json.load(f)
+
+    def _write(self, registry):
+        path = os.path.join(self.root_dir, "registry.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(registry, f, indent=2)
+        os.replace(path + ".tmp", path)
+
+    def _path(self, version):
+        return os.path.join(self.root_dir, "versions", version)
+
+    def register(self, ml_api, metrics=None):
+        """
+        Save the model of ml_api as a new version (not yet active).
+        Args:
+            ml_api (MLAPI): Trained model to store.
+            metrics (dict): Extra metrics to record next to the training metrics of the fit.
+        Returns:
+            str: The new version id (v0001, v0002, ...).
+        """
+        with self._lock:
+            registry = self._read()
+            version = f"v{len(registry['versions']) + 1:04d}"
+            metadata = ml_api.save_model(self._path(version))
+            registry["versions"][version] = {
+                "registered_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "feature_columns": metadata["feature_columns"],
+                "fingerprint": metadata["fingerprint"],
+                "metrics": {**(ml_api.training_metrics or {}), **(metrics or {})},
+                "shadow": None,
+                "pruned_at": None
+            }
+            self._write(registry)
+        return version
+
+    def promote(self, version):
+        """
+        Make version the active one, on top of the versions rollback returns to.
+        Raises:
+            KeyError: version is not registered.
+        """
+        with self._lock:
+            registry = self._read()
+            if version not in registry["versions"]:
+                raise KeyError(f"Model version {version} is not registered")
+            if registry["versions"][version].get("pruned_at"):
+                raise KeyError(f"Model version {version} was pruned")
+            if registry["active"] != version:
+                registry["stack"].append(version)
+                del registry["stack"][:-self.max_rollback]
+            registry["active"] = version
+            registry["promotions"].append({"version": version, "promoted_at": time.strftime("%Y-%m-%dT%H:%M:%S")})
+            self._prune(registry)
+            self._write(registry)
+
+    def rollback(self):
+        """
+        Re-activate the version that was active before the current one; repeated calls walk further back.
+        Returns:
+            str: The version now active, or None when there is nothing to roll back to.
+        """
+        with self._lock:
+            registry = self._read()
+            if len(registry["stack"]) < 2:
+                return None
+            registry["stack"].pop()
+            version = registry["active"] = registry["stack"][-1]
+            registry["promotions"].append({
+                "version": version,
+                "promoted_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "rollback": True
+            })
+            self._prune(registry)
+            self._write(registry)
+        return version
+
+    def _prune(self, registry):
+        """
+        Delete the artifacts of promoted versions that are no longer on the rollback stack.
+        Their registry entries (metrics, shadow statistics) are kept and marked with pruned_at.
+        Versions that were never promoted, such as candidates under shadow scoring, are left alone.
+        """
+        promoted = {promotion["version"] for promotion in registry["promotions"]}
+        for version, entry in registry["versions"].items():
+            if version in promoted and version not in registry["stack"] and not entry.get("pruned_at"):
+                shutil.rmtree(self._path(version), ignore_errors=True)
+                entry["pruned_at"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+
+    def find_version(self, fingerprint):
+        """
+        The newest version (not pruned) trained on data with this fingerprint, or None.
+        Args:
+            fingerprint (str): As returned by MLAPI.training_fingerprint.
+        """
+        with self._lock:
+            registry = self._read()
+        for version, entry in reversed(list(registry["versions"].items())):
+            if entry["fingerprint"] == fingerprint and not entry.get("pruned_at"):
+                return version
+        return None
+
+    def active_version(self):
+        """The active version id, or None."""
+        with self._lock:
+            return self._read()["active"]
+
+    def load(self, version, ml_api=None):
+        """
+        Load a registered version.
+        Args:
+            version (str): Version id.
+            ml_api (MLAPI): Instance to load into (keeps its retraining and inference settings);
+                            a new MLAPI when None.
+        Returns:
+            MLAPI: The loaded model.
+        Raises:
+            KeyError: version is not registered.
+            FileNotFoundError: The version's artifact was pruned.
+            ValueError: The artifact does not fit this code (see MLAPI.load_model).
+        """
+        with self._lock:
+            if version not in self._read()["versions"]:
+                raise KeyError(f"Model version {version} is not registered")
+        ml_api = ml_api or MLAPI()
+        ml_api.load_model(self._path(version))
+        return ml_api
+
+    def load_active(self, ml_api=None):
+        """
+        Load the active version.
+        Raises:
+            FileNotFoundError: No version has been promoted yet.
+        """
+        version = self.active_version()
+        if version is None:
+            raise FileNotFoundError(f"No active model in {self.root_dir}")
+        return self.load(version, ml_api)
+
+    def record_shadow(self, version, stats):
+        """Store the shadow statistics gathered for a candidate version."""
+        with self._lock:
+            registry = self._read()
+            registry["versions"][version]["shadow"] = {**stats, "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S")}
+            self._write(registry)
+
+    def list_versions(self):
+        """
+        Returns:
+            pd.DataFrame: One row per version with its registration time, metrics, shadow disagreement
+                          rate and whether it is active.
+        """
+        with self._lock:
+            registry = self._read()
+        rows = []
+        for version, entry in registry["versions"].items():
+            shadow = entry["shadow"] or {}
+            rows.append({
+                "version": version,
+                "active": version == registry["active"],
+                "registered_at": entry["registered_at"],
+                "pruned": bool(entry.get("pruned_at")),
+                **entry["metrics"],
+                "shadow_disagreement_rate": shadow.get("disagreement_rate")
+            })
+        return pd.DataFrame(rows)
+
+
+class ShadowScorer:
+    """
+    Scores requests with the primary model and replays them against a candidate on a background thread,
+    counting where the two disagree. The candidate never adds latency to, or changes, the primary result.
+    """
+
+    def __init__(self, primary, candidate, max_pending=1000):
+        """
+        Args:
+            primary (MLAPI): Model whose predictions are returned.
+            candidate (MLAPI): Model scored in the background.
+            max_pending (int): Requests queued for the candidate before further ones are dropped
+                               (counted in stats) rather than blocking the caller.
+        """
+        self.primary = primary
+        self.candidate = candidate
+        self._pending = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        self._stats = dict.fromkeys(["requests", "rows", "disagreements", "dropped", "errors"], 0)
+        self._risk_difference = 0.0
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def predict_risk(self, unlabeled_data):
+        """
+        Score with the primary model and queue the same rows for the candidate.
+        Args:
+            unlabeled_data (DataFrame): As for MLAPI.predict_risk (not a FeatureStore, whose rows can
+                                        change before the candidate gets to them).
+        Returns:
+            DataFrame: The primary model's predictions.
+        """
+        predictions = self.primary.predict_risk(unlabeled_data)
+        try:
+            self._pending.put_nowait((unlabeled_data, predictions))
+        except queue.Full:
+            with self._lock:
+                self._stats["dropped"] += 1
+        return predictions
+
+    def _run(self):
+        while True:
+            item = self._pending.get()
+            if item is None:
+                self._pending.task_done()
+                return
+            unlabeled_data, primary_predictions = item
+            try:
+                candidate_predictions = self.candidate.predict_risk(unlabeled_data)
+                disagreements = int(np.count_nonzero(
+                    primary_predictions["AtRisk"].to_numpy() != candidate_predictions["AtRisk"].to_numpy()
+                ))
+                risk_difference = float(np.abs(
+                    primary_predictions["RiskLevel"].to_numpy() - candidate_predictions["RiskLevel"].to_numpy()
+                ).sum())
+                with self._lock:
+                    self._stats["requests"] += 1
+                    self._stats["rows"] += len(primary_predictions)
+                    self._stats["disagreements"] += disagreements
+                    self._risk_difference += risk_difference
+            except Exception:
+                with self._lock:
+                    self._stats["errors"] += 1
+            finally:
+                self._pending.task_done()
+
+    def stats(self):
+        """
+        Returns:
+            dict: Requests and rows compared, AtRisk disagreements and their rate per row, the mean absolute
+                  RiskLevel difference, and requests dropped or failed on the candidate side.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            rows = stats["rows"]
+            stats["disagreement_rate"] = stats["disagreements"] / rows if rows else None
+            stats["mean_risk_difference"] = self._risk_difference / rows if rows else None
+        return stats
+
+    def close(self, wait=True):
+        """Stop the background worker, after the queued requests when wait is True."""
+        if wait:
+            self._pending.join()
+        self._pending.put(None)
+        self._worker.join()
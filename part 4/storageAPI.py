@@ -0,0 +1,432 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Xueyao Zhao
+"""
+
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import mysql.connector
+from mysql.connector import pooling
+
+
+class MySQLBackend:
+    """Pooled MySQL server storage (the default for InsuranceAPI)."""
+    name = "mysql"
+    Error = mysql.connector.Error
+    supports_load_data = True
+    lock_clause = " FOR UPDATE"  # Appended to SELECTs of rows the transaction is about to change
+
+    def __init__(self, host, user, password, pool_size=5, pool_timeout=10, pool_ping=True,
+                 allow_local_infile=False, statement_cache_size=64):
+        """
+        Initialize the connection settings.
+        Args:
+            pool_size (int): Connections kept open per database (MySQL caps this at 32).
+            pool_timeout (float): Seconds to wait for a free pooled connection before giving up.
+            pool_ping (bool): Ping checked-out connections and reconnect them if the server dropped them.
+            allow_local_infile (bool): Allow LOAD DATA LOCAL INFILE (the server must enable local_infile too).
+            statement_cache_size (int): Prepared statements kept per pooled connection (least recently used are closed).
+        """
+        self.host = host
+        self.user = user
+        self.password = password
+        self.pool_size = pool_size
+        self.pool_timeout = pool_timeout
+        self.pool_ping = pool_ping
+        self.allow_local_infile = allow_local_infile
+        self.statement_cache_size = statement_cache_size
+        self.pools = {}  # One connection pool per database name ("" is the server-level pool)
+        self._pool_lock = threading.Lock()
+        self._statements = {}  # (pool name, server connection id) -> OrderedDict of SQL text -> prepared cursor
+
+    def _get_pool(self, db_name=None):
+        """Return the connection pool for db_name, creating it on first use."""
+        key = db_name or ""
+        with self._pool_lock:
+            if key in self.pools:
+                return self.pools[key]
+            config = {
+                "host": self.host,
+                "user": self.user,
+                "password": self.password,
+                "allow_local_infile": self.allow_local_infile
+            }
+            if db_name:
+                config["database"] = db_name  # Connect directly to the specified database
+            self.pools[key] = pooling.MySQLConnectionPool(
+                pool_name=f"insurance_{key or 'server'}_{id(self)}",
+                pool_size=self.pool_size,
+                pool_reset_session=False,  # A reset would deallocate the cached prepared statements (release rolls back)
+                **config
+            )
+            return self.pools[key]
+
+    def connect(self, db_name=None):
+        """Check out a healthy connection from the pool for db_name."""
+        pool = self._get_pool(db_name)
+        deadline = time.monotonic() + self.pool_timeout
+        while True:
+            try:
+                connection = pool.get_connection()
+                break
+            except pooling.PoolError:
+                # Pool exhausted: wait for another caller to return a connection
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(0.01)
+        if self.pool_ping:
+            # Health check: reopen connections the server closed while they sat idle
+            session = connection.connection_id
+            connection.ping(reconnect=True, attempts=3, delay=0)
+            if connection.connection_id != session:
+                # The statements prepared on the old session died with it
+                self._statements.pop((connection.pool_name, session), None)
+        return connection
+
+    def cursor(self, connection):
+        """Open a regular cursor."""
+        return connection.cursor()
+
+    def prepared_cursor(self, connection, query):
+        """
+        Return the server-side prepared statement for query on this connection, preparing it on first use.
+        Statements live as long as the pooled session, so repeated calls skip parsing and planning.
+        """
+        statements = self._statements.setdefault((connection.pool_name, connection.connection_id), OrderedDict())
+        cursor = statements.get(query)
+        if cursor is None:
+            cursor = connection.cursor(prepared=True)
+            statements[query] = cursor
+            if len(statements) > self.statement_cache_size:
+                _, evicted = statements.popitem(last=False)
+                evicted.close()
+        else:
+            statements.move_to_end(query)
+        return cursor
+
+    def stream_cursor(self, connection):
+        """Open a cursor that reads rows from the server as they are fetched."""
+        return connection.cursor(buffered=False)
+
+    def release(self, connection):
+        """
+        Return a connection to its pool.
+        The open transaction is rolled back first (the pool does not reset sessions), so the next caller
+        neither reads from this caller's REPEATABLE READ snapshot nor commits its unfinished writes.
+        Rolling back keeps the session's prepared statements.
+        """
+        try:
+            if connection.unread_result:
+                connection.consume_results()  # A reader stopped early; drain before the connection is reused
+            connection.rollback()  # No-op after a commit
+        except self.Error:
+            pass  # A broken session is reconnected by the ping on its next checkout
+        connection.close()  # Pooled connections go back to the pool instead of disconnecting
+
+    def create_database(self, db_name):
+        """Create a database if it doesn't exist."""
+        connection = self.connect()
+        try:
+            cursor = connection.cursor()
+            cursor.execute(f"CREATE DATABASE IF NOT EXISTS {db_name}")
+            cursor.close()
+        finally:
+            self.release(connection)
+
+    def drop_database(self, db_name):
+        """Drop the database if it exists."""
+        connection = self.connect()
+        try:
+            cursor = connection.cursor()
+            cursor.execute(f"DROP DATABASE IF EXISTS {db_name}")
+            cursor.close()
+        finally:
+            self.release(connection)
+        self.close_pools(db_name)  # Pooled sessions still point at the dropped database
+
+    def close_pools(self, db_name=None):
+        """Close the idle pooled connections for db_name, or for every database when omitted."""
+        with self._pool_lock:
+            keys = [db_name or ""] if db_name is not None else list(self.pools)
+            pools = [self.pools.pop(key, None) for key in keys]
+        names = {pool.pool_name for pool in pools if pool}
+        for pool in pools:
+            if pool:
+                pool._remove_connections()
+        # Drop the prepared statements of the closed sessions
+        for key in [key for key in list(self._statements) if key[0] in names]:
+            self._statements.pop(key, None)
+
+    def upsert_clause(self, key_columns, update_columns):
+        """Clause appended to an INSERT so rows whose key already exists are updated instead."""
+        assignments = ", ".join(f"{col} = VALUES({col})" for col in update_columns)
+        return f"ON DUPLICATE KEY UPDATE {assignments}"
+
+
+    def scanned_tables(self, cursor, query, params=None):
+        """EXPLAIN query and return the tables it reads with a full scan (access type ALL)."""
+        cursor.execute("EXPLAIN " + query, params)
+        rows = cursor.fetchall()
+        columns = [col[0] for col in cursor.description]
+        table, access_type = columns.index("table"), columns.index("type")
+        return [row[table] for row in rows if row[access_type] == "ALL"]
+
+
+class _TranslatingCursor:
+    """Cursor wrapper that rewrites the MySQL-flavoured SQL used by InsuranceAPI before running it."""
+
+    def __init__(self, cursor, translate):
+        self._cursor = cursor
+        self._translate = translate
+
+    def execute(self, query, params=None):
+        if params is None:
+            self._cursor.execute(self._translate(query))
+        else:
+            self._cursor.execute(self._translate(query), params)
+        return self
+
+    def executemany(self, query, rows):
+        self._cursor.executemany(self._translate(query), rows)
+        return self
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchmany(self, size):
+        return self._cursor.fetchmany(size)
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def close(self):
+        self._cursor.close()
+
+
+class SQLiteBackend:
+    """In-process SQLite storage: one database file per db_name under data_dir."""
+    name = "sqlite"
+    Error = sqlite3.Error
+    supports_load_data = False
+    lock_clause = ""  # Writers already hold the database lock
+
+    def __init__(self, data_dir=".", timeout=10):
+        """
+        Args:
+            data_dir (str): Directory holding the <db_name>.sqlite files.
+            timeout (float): Seconds a writer waits for another connection's lock.
+        """
+        self.data_dir = data_dir
+        self.timeout = timeout
+
+    def _path(self, db_name):
+        return os.path.join(self.data_dir, f"{db_name}.sqlite")
+
+    def translate(self, query):
+        """Rewrite MySQL syntax into SQLite syntax."""
+        query = re.sub(r"(\w+) INT AUTO_INCREMENT PRIMARY KEY", r"\1 INTEGER PRIMARY KEY AUTOINCREMENT", query)
+        return query.replace("%s", "?").replace("CURDATE()", "CURRENT_DATE")
+
+    def connect(self, db_name=None):
+        """Open a connection to the database file (connections are cheap, so they are not pooled)."""
+        connection = sqlite3.connect(self._path(db_name), timeout=self.timeout, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")  # Open readers (e.g. chunked fetches) must not block writers
+        return connection
+
+    def cursor(self, connection):
+        return _TranslatingCursor(connection.cursor(), self.translate)
+
+    def prepared_cursor(self, connection, query):
+        """sqlite3 keeps its own per-connection cache of compiled statements."""
+        return self.cursor(connection)
+
+    def stream_cursor(self, connection):
+        """SQLite cursors already step through the result lazily."""
+        return self.cursor(connection)
+
+    def release(self, connection):
+        connection.close()
+
+    def create_database(self, db_name):
+        """The file is created on first connect; only the directory has to exist."""
+        os.makedirs(self.data_dir, exist_ok=True)
+
+    def drop_database(self, db_name):
+        """Delete the database file and its journals."""
+        for suffix in ("", "-journal", "-wal", "-shm"):
+            path = self._path(db_name) + suffix
+            if os.path.exists(path):
+                os.remove(path)
+
+    def close_pools(self, db_name=None):
+        """Nothing is pooled."""
+        pass
+
+    def upsert_clause(self, key_columns, update_columns):
+        """Clause appended to an INSERT so rows whose key already exists are updated instead."""
+        assignments = ", ".join(f"{col} = excluded.{col}" for col in update_columns)
+        return f"ON CONFLICT ({', '.join(key_columns)}) DO UPDATE SET {assignments}"
+
+    def scanned_tables(self, cursor, query, params=None):
+        """EXPLAIN QUERY PLAN query and return the tables it scans without a real index."""
+        cursor.execute("EXPLAIN QUERY PLAN " + query, params)
+        scanned = []
+        for row in cursor.fetchall():
+            detail = row[-1].replace("TABLE ", "")
+            # SQLite may build a throwaway "automatic" index, which still reads the whole table
+            if detail.startswith("SCAN ") and "CONSTANT ROW" not in detail or "AUTOMATIC" in detail:
+                scanned.append(detail.split()[1])
+        return scanned
+
+
+class _DuckDBConnection:
+    """
+    Wrapper giving a DuckDB connection MySQL-like transactions: DDL runs on its own, the first
+    INSERT/UPDATE/DELETE opens a transaction, and commit() or rollback() ends it.
+    """
+
+    def __init__(self, connection, translate):
+        self._connection = connection
+        self._translate = translate
+        self.in_transaction = False
+
+    def cursor(self):
+        # A DuckDB cursor is a separate connection with its own transaction, so statements run on this one
+        return _TranslatingCursor(_DuckDBStatements(self), self._translate)
+
+    def run(self, method, query, params):
+        """Run a statement, opening a transaction first if it writes rows."""
+        if not self.in_transaction and query.lstrip()[:6].upper() in ("INSERT", "UPDATE", "DELETE"):
+            self._connection.begin()
+            self.in_transaction = True
+        if params is None:
+            getattr(self._connection, method)(query)
+        else:
+            getattr(self._connection, method)(query, params)
+
+    def commit(self):
+        if self.in_transaction:
+            self._connection.commit()
+            self.in_transaction = False
+
+    def rollback(self):
+        if self.in_transaction:
+            self._connection.rollback()
+            self.in_transaction = False
+
+    def close(self):
+        self._connection.close()
+
+
+class _DuckDBStatements:
+    """Minimal DB-API cursor over a wrapped DuckDB connection."""
+    rowcount = -1
+
+    def __init__(self, connection):
+        self._connection = connection
+
+    def execute(self, query, params=None):
+        self._connection.run("execute", query, params)
+
+    def executemany(self, query, rows):
+        self._connection.run("executemany", query, rows)
+
+    def fetchone(self):
+        return self._connection._connection.fetchone()
+
+    def fetchmany(self, size):
+        return self._connection._connection.fetchmany(size)
+
+    def fetchall(self):
+        return self._connection._connection.fetchall()
+
+    @property
+    def description(self):
+        return self._connection._connection.description
+
+    def close(self):
+        pass
+
+
+class DuckDBBackend:
+    """In-process DuckDB storage: one database file per db_name under data_dir."""
+    name = "duckdb"
+    supports_load_data = False
+    lock_clause = ""  # Conflicting transactions fail at commit
+
+    def __init__(self, data_dir="."):
+        """
+        Args:
+            data_dir (str): Directory holding the <db_name>.duckdb files.
+        """
+        import duckdb  # Optional dependency, only needed for this backend
+        self.duckdb = duckdb
+        self.Error = duckdb.Error
+        self.data_dir = data_dir
+
+    def _path(self, db_name):
+        return os.path.join(self.data_dir, f"{db_name}.duckdb")
+
+    def translate(self, query):
+        """Rewrite MySQL syntax into DuckDB syntax (auto-increment keys become sequences)."""
+        table = re.search(r"CREATE TABLE (\w+)", query)
+        if table and "AUTO_INCREMENT" in query:
+            sequence = f"seq_{table.group(1)}"
+            query = f"CREATE SEQUENCE IF NOT EXISTS {sequence}; " + re.sub(
+                r"(\w+) INT AUTO_INCREMENT PRIMARY KEY",
+                rf"\1 INTEGER PRIMARY KEY DEFAULT nextval('{sequence}')",
+                query
+            )
+        return query.replace("%s", "?").replace("CURDATE()", "CURRENT_DATE")
+
+    def connect(self, db_name=None):
+        return _DuckDBConnection(self.duckdb.connect(self._path(db_name)), self.translate)
+
+    def cursor(self, connection):
+        return connection.cursor()
+
+    def prepared_cursor(self, connection, query):
+        return connection.cursor()
+
+    def stream_cursor(self, connection):
+        return connection.cursor()
+
+    def release(self, connection):
+        connection.close()
+
+    def create_database(self, db_name):
+        """The file is created on first connect; only the directory has to exist."""
+        os.makedirs(self.data_dir, exist_ok=True)
+
+    def drop_database(self, db_name):
+        """Delete the database file and its write-ahead log."""
+        for suffix in ("", ".wal"):
+            path = self._path(db_name) + suffix
+            if os.path.exists(path):
+                os.remove(path)
+
+    def close_pools(self, db_name=None):
+        """Nothing is pooled."""
+        pass
+
+    def upsert_clause(self, key_columns, update_columns):
+        """Clause appended to an INSERT so rows whose key already exists are updated instead."""
+        assignments = ", ".join(f"{col} = excluded.{col}" for col in update_columns)
+        return f"ON CONFLICT ({', '.join(key_columns)}) DO UPDATE SET {assignments}"
+
+    def scanned_tables(self, cursor, query, params=None):
+        """DuckDB plans are not table-access based, so there is nothing to check."""
+        return None